@@ -0,0 +1,44 @@
+"""Compare the speed of the df_from_file csv engines on synthetic tables."""
+import os
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from skm_pyutils.table import df_from_file
+
+
+def time_read(filename, engine, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        t1 = perf_counter()
+        df_from_file(filename, engine=engine, cache=False)
+        best = min(best, perf_counter() - t1)
+    return best
+
+
+def main(repeats=3):
+    rng = np.random.default_rng(0)
+    tables = {
+        "wide (20000 x 500)": pd.DataFrame(rng.random((20000, 500))).add_prefix("c"),
+        "long (1000000 x 8)": pd.DataFrame(rng.random((1000000, 8))).add_prefix("c"),
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, df in tables.items():
+            filename = os.path.join(temp_dir, "table.csv")
+            df.to_csv(filename, index=False)
+            size = os.path.getsize(filename) / 1e6
+            times = {
+                engine: time_read(filename, engine, repeats)
+                for engine in ("c", "pyarrow", "auto")
+            }
+            print(
+                f"{name}, {size:.0f} MB: "
+                + ", ".join(f"{k} {v:.2f}s" for k, v in times.items())
+                + f", pyarrow speedup {times['c'] / times['pyarrow']:.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
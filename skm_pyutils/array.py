@@ -8,3 +8,270 @@ def non_zero_divide(numerator, denominator):
         numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0
     )
     return result
+
+
+class QuantileSketch:
+    """
+    Mergeable approximate quantiles of a stream of values.
+
+    Values are counted in logarithmically sized buckets (as in DDSketch),
+    so any quantile is returned within the given relative accuracy,
+    memory grows only with the log of the range of the values,
+    and two sketches are merged by adding their bucket counts.
+
+    Parameters
+    ----------
+    relative_accuracy : float, optional
+        The maximum relative error of returned quantiles, by default 0.01.
+
+    """
+
+    # Values smaller in magnitude than this are counted as zero
+    min_value = 1e-12
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _add(self, store, values):
+        keys, counts = np.unique(
+            np.ceil(np.log(values) / self._log_gamma).astype(np.int64),
+            return_counts=True,
+        )
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def update(self, values):
+        """Add values to the sketch, NaN values are ignored."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        small = np.abs(values) < self.min_value
+        self.zeros += int(np.sum(small))
+        self._add(self.positive, values[(values > 0) & ~small])
+        self._add(self.negative, -values[(values < 0) & ~small])
+        self.count += len(values)
+
+    def combine(self, other):
+        """Merge another sketch with the same relative accuracy into this one."""
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot combine sketches with different accuracy")
+        for store, other_store in (
+            (self.positive, other.positive),
+            (self.negative, other.negative),
+        ):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        Estimate the q-th quantile(s) of the values.
+
+        Parameters
+        ----------
+        q : float or list of float
+            Quantile(s) between 0 and 1.
+
+        Returns
+        -------
+        float or np.ndarray
+            The estimated quantile(s), NaN if no values have been added.
+
+        """
+        qs = np.atleast_1d(np.asarray(q, dtype=float))
+        if self.count == 0:
+            out = np.full(len(qs), np.nan)
+            return out if np.ndim(q) else out[0]
+        scale = 2 / (self.gamma + 1)
+        neg_keys = sorted(self.negative, reverse=True)
+        pos_keys = sorted(self.positive)
+        values = np.concatenate(
+            [
+                [-scale * self.gamma ** k for k in neg_keys],
+                [0.0] if self.zeros > 0 else [],
+                [scale * self.gamma ** k for k in pos_keys],
+            ]
+        )
+        counts = np.concatenate(
+            [
+                [self.negative[k] for k in neg_keys],
+                [self.zeros] if self.zeros > 0 else [],
+                [self.positive[k] for k in pos_keys],
+            ]
+        )
+        ranks = qs * (self.count - 1)
+        idx = np.searchsorted(np.cumsum(counts), ranks, side="right")
+        out = values[np.minimum(idx, len(values) - 1)]
+        return out if np.ndim(q) else out[0]
+
+
+class RunningStats:
+    """
+    Streaming column statistics which ignore NaN values.
+
+    Data is added in chunks of rows with update, and accumulators of
+    different chunks can be merged with combine, using the parallel
+    form of Welford's algorithm. So the mean and standard deviation of
+    very large data can be found in a single pass with bounded memory.
+    For data added in one chunk, the results match np.nanmean and
+    np.nanstd exactly.
+
+    Parameters
+    ----------
+    quantiles : bool, optional
+        Keep a QuantileSketch of each column, by default False.
+    relative_accuracy : float, optional
+        The relative accuracy of the quantile sketches, by default 0.01.
+
+    Attributes
+    ----------
+    count : np.ndarray
+        The number of non NaN values in each column.
+    mean : np.ndarray
+        The mean of each column.
+    m2 : np.ndarray
+        The sum of squared differences from the mean of each column.
+    min : np.ndarray
+        The minimum of each column.
+    max : np.ndarray
+        The maximum of each column.
+    sketches : list of QuantileSketch or None
+        The quantile sketch of each column, if quantiles is True.
+
+    """
+
+    def __init__(self, quantiles=False, relative_accuracy=0.01):
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.sketches = None
+
+    def update(self, data):
+        """
+        Add a chunk of data to the statistics.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            A 2D array of shape (rows, columns).
+
+        Returns
+        -------
+        None
+
+        """
+        data = np.ascontiguousarray(data, dtype=float)
+        if data.ndim != 2:
+            raise ValueError(f"Expected 2D data, got {data.ndim}D")
+        mask = np.isnan(data)
+        count = data.shape[0] - np.sum(mask, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nansum(data, axis=0) / count
+            diff = np.subtract(data, mean)
+            diff[mask] = 0
+            m2 = np.sum(diff * diff, axis=0)
+        other = RunningStats()
+        other.count, other.mean, other.m2 = count, mean, m2
+        # fmin and fmax ignore NaN, and give NaN for all NaN columns
+        other.min = np.fmin.reduce(data, axis=0)
+        other.max = np.fmax.reduce(data, axis=0)
+        if self.quantiles:
+            other.sketches = []
+            for col in data.T:
+                sketch = QuantileSketch(self.relative_accuracy)
+                sketch.update(col)
+                other.sketches.append(sketch)
+        self.combine(other)
+
+    def combine(self, other):
+        """
+        Merge the statistics of another RunningStats into these.
+
+        Parameters
+        ----------
+        other : RunningStats
+            The statistics to merge, must have the same number of columns.
+
+        Returns
+        -------
+        None
+
+        """
+        if other.count is None:
+            return
+        if self.count is None:
+            self.count = other.count.copy()
+            self.mean = other.mean.copy()
+            self.m2 = other.m2.copy()
+            self.min = other.min.copy()
+            self.max = other.max.copy()
+            if self.quantiles:
+                self.sketches = [
+                    QuantileSketch(self.relative_accuracy) for _ in self.count
+                ]
+                for sketch, other_sketch in zip(self.sketches, other.sketches):
+                    sketch.combine(other_sketch)
+            return
+        if self.count.shape != other.count.shape:
+            raise ValueError(
+                f"Cannot combine {self.count.shape[0]} columns "
+                + f"with {other.count.shape[0]} columns"
+            )
+        count = self.count + other.count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = other.mean - self.mean
+            mean = self.mean + delta * (other.count / count)
+            m2 = self.m2 + other.m2 + delta * delta * (self.count * other.count / count)
+        # Columns with no values yet on one side take the other side as is
+        mean = np.where(self.count == 0, other.mean, mean)
+        mean = np.where(other.count == 0, self.mean, mean)
+        m2 = np.where(self.count == 0, other.m2, m2)
+        m2 = np.where(other.count == 0, self.m2, m2)
+        self.count, self.mean, self.m2 = count, mean, m2
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        if self.quantiles:
+            for sketch, other_sketch in zip(self.sketches, other.sketches):
+                sketch.combine(other_sketch)
+
+    @property
+    def var(self):
+        """The population variance of each column, as np.nanvar."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.m2 / self.count
+
+    @property
+    def std(self):
+        """The population standard deviation of each column, as np.nanstd."""
+        return np.sqrt(self.var)
+
+    def quantile(self, q):
+        """
+        Estimate the q-th quantile of each column from the sketches.
+
+        Parameters
+        ----------
+        q : float
+            The quantile, between 0 and 1.
+
+        Returns
+        -------
+        np.ndarray
+            The estimated quantile of each column,
+            clipped to the exact minimum and maximum.
+
+        """
+        if not self.quantiles:
+            raise ValueError("RunningStats was created with quantiles=False")
+        estimate = np.array([sketch.quantile(q) for sketch in self.sketches])
+        return np.clip(estimate, self.min, self.max)
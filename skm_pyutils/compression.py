@@ -0,0 +1,113 @@
+"""Transparent file compression, chosen by the file suffix."""
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import os
+
+COMPRESSION_SUFFIXES = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".zst": "zstd",
+    ".lz4": "lz4",
+}
+
+
+def get_compression(filename):
+    """Return the compression of filename from its suffix, or None."""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1].lower())
+
+
+def strip_compression(filename):
+    """Return filename without its compression suffix, e.g. out.csv.gz -> out.csv."""
+    if get_compression(filename) is None:
+        return filename
+    return os.path.splitext(filename)[0]
+
+
+def open_file(filename, mode="r", level=None, threads=-1, encoding=None, newline=None):
+    """
+    Open a file, compressing or decompressing it based on its suffix.
+
+    The suffixes .gz, .bz2 and .xz use the standard library,
+    .zst needs the zstandard package and .lz4 the lz4 package.
+    Other files are opened with the builtin open.
+    Data is compressed and decompressed as it is streamed,
+    so the whole file is never held in memory.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the file.
+    mode : str, optional
+        The mode to open the file in, by default "r".
+        Text and binary read, write and append modes are supported.
+    level : int, optional
+        The compression level, by default the codec's default
+        (6 for gzip, which is much faster than the maximum of 9).
+    threads : int, optional
+        The number of threads to compress with, for zstd only.
+        By default -1, which uses one thread per CPU.
+    encoding : str, optional
+        The text encoding, by default the platform default.
+    newline : str, optional
+        As for the builtin open, by default None.
+
+    Returns
+    -------
+    file object
+
+    """
+    codec = get_compression(filename)
+    binary = "b" in mode
+    if codec is None:
+        if binary:
+            return open(filename, mode)
+        return open(filename, mode, encoding=encoding, newline=newline)
+
+    raw_mode = mode.replace("t", "").replace("b", "") + "b"
+    if codec == "gzip":
+        f = gzip.open(filename, raw_mode, compresslevel=6 if level is None else level)
+    elif codec == "bz2":
+        f = bz2.open(filename, raw_mode, compresslevel=9 if level is None else level)
+    elif codec == "xz":
+        f = lzma.open(filename, raw_mode, preset=level)
+    elif codec == "zstd":
+        import zstandard
+
+        cctx = zstandard.ZstdCompressor(
+            level=3 if level is None else level, threads=threads
+        )
+        f = zstandard.open(filename, raw_mode, cctx=cctx)
+    else:
+        import lz4.frame
+
+        f = lz4.frame.open(
+            filename, raw_mode, compression_level=0 if level is None else level
+        )
+    if binary:
+        return f
+    return io.TextIOWrapper(f, encoding=encoding, newline=newline)
+
+
+@contextlib.contextmanager
+def path_or_open_file(filename):
+    """
+    Give filename itself, or an open decompressed file if it is compressed.
+
+    Useful for readers such as pandas.read_csv, which are fastest
+    with a path, but don't support every codec.
+
+    Example
+    -------
+    with path_or_open_file("results.csv.lz4") as source:
+        df = pd.read_csv(source)
+
+    """
+    if get_compression(filename) is None:
+        yield filename
+    else:
+        with open_file(filename, "rb") as f:
+            yield f
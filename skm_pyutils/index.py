@@ -0,0 +1,369 @@
+"""Persistent on-disk indexes of directory trees and file contents."""
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from skm_pyutils.path import _scan_dir, file_hash, make_path_if_not_exists
+
+
+def get_default_index_loc(name="dir_index.sqlite"):
+    """Get the default location of index files, home/.skm_python/name."""
+    return os.path.join(os.path.expanduser("~"), ".skm_python", name)
+
+
+class DirectoryIndex:
+    """
+    An on-disk index of the files in a directory tree.
+
+    The index is stored in SQLite and keyed by the absolute root directory,
+    so one database can hold the index of many roots.
+    For each file the size and modification time are stored,
+    and for each directory its modification time.
+
+    Refreshing the index only re-scans directories whose modification
+    time has changed since the last refresh, so repeated refreshes of
+    large, mostly static trees only cost one stat call per directory.
+    The index can then be passed to the functions in skm_pyutils.path,
+    such as get_all_files_in_dir, to answer queries without walking.
+
+    Parameters
+    ----------
+    root : str
+        The directory to index.
+    location : str, optional
+        The path to the SQLite database,
+        by default home/.skm_python/dir_index.sqlite.
+
+    Notes
+    -----
+    A directory's modification time only changes when entries are added,
+    removed or renamed in it, not when a file is modified in place.
+    So the stored size and mtime of modified files can be stale until
+    a full refresh is performed with refresh(full=True).
+    Symlinks to directories are not followed, as in path.walk_dir.
+
+    Example
+    -------
+    with DirectoryIndex(data_root) as index:
+        index.refresh()
+        files = get_all_files_in_dir(data_root, ext="csv", index=index)
+
+    """
+
+    def __init__(self, root, location=None):
+        self.root = os.path.abspath(root)
+        if location is None:
+            location = get_default_index_loc()
+        self.location = location
+        make_path_if_not_exists(self.location)
+        self._conn = sqlite3.connect(self.location)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS dirs (
+                root TEXT, dir TEXT, parent TEXT, mtime INTEGER,
+                PRIMARY KEY (root, dir)
+            );
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (root, parent);
+            CREATE TABLE IF NOT EXISTS files (
+                root TEXT, dir TEXT, name TEXT, size INTEGER, mtime INTEGER,
+                PRIMARY KEY (root, dir, name)
+            );
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"DirectoryIndex({self.root!r}, location={self.location!r})"
+
+    def close(self):
+        """Close the connection to the database."""
+        self._conn.close()
+
+    def refresh(self, full=False):
+        """
+        Update the index to match the directory tree on disk.
+
+        Parameters
+        ----------
+        full : bool, optional
+            Re-scan every directory, even if its modification time
+            has not changed, by default False.
+
+        Returns
+        -------
+        int
+            The number of directories that were re-scanned.
+
+        """
+        if not os.path.isdir(self.root):
+            raise ValueError("Non existant directory " + str(self.root))
+        known = dict(
+            self._conn.execute(
+                "SELECT dir, mtime FROM dirs WHERE root = ?", (self.root,)
+            )
+        )
+        n_scanned = 0
+        stack = [""]
+        with self._conn:
+            while stack:
+                rel_dir = stack.pop()
+                path = os.path.join(self.root, rel_dir)
+                try:
+                    # Stat before scanning, so changes during the scan
+                    # are picked up by the next refresh
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    self._remove_tree(rel_dir)
+                    continue
+                if not full and known.get(rel_dir) == mtime:
+                    stack.extend(self._children(rel_dir))
+                    continue
+
+                n_scanned += 1
+                dirs, files = _scan_dir(path)
+                rows = []
+                for entry in files:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    rows.append(
+                        (self.root, rel_dir, entry.name, st.st_size, st.st_mtime_ns)
+                    )
+                self._conn.execute(
+                    "DELETE FROM files WHERE root = ? AND dir = ?", (self.root, rel_dir)
+                )
+                self._conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", rows)
+
+                children = [
+                    os.path.join(rel_dir, d.name) for d in dirs if not d.is_symlink()
+                ]
+                for removed in set(self._children(rel_dir)).difference(children):
+                    self._remove_tree(removed)
+                parent = os.path.dirname(rel_dir) if rel_dir != "" else None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                    (self.root, rel_dir, parent, mtime),
+                )
+                stack.extend(children)
+        return n_scanned
+
+    def walk(self, start_dir=None, recursive=True, dir_filter=None):
+        """
+        Walk the indexed tree, in the same way as path.walk_dir.
+
+        Parameters
+        ----------
+        start_dir : str, optional
+            The directory to start at, must be inside the index root.
+            By default the index root.
+        recursive : bool, optional
+            Whether to recurse through directories, by default True.
+        dir_filter : callable, optional
+            Called with the path of each subdirectory relative to start_dir,
+            if it returns False the whole subtree is skipped.
+
+        Yields
+        ------
+        tuple of (str, list of str, list of str)
+            The root relative to start_dir, the directory names
+            and the file names.
+
+        Raises
+        ------
+        ValueError
+            If start_dir is not in the index, e.g. it has not been refreshed.
+
+        """
+        start_rel = self._relative(start_dir)
+        exists = self._conn.execute(
+            "SELECT 1 FROM dirs WHERE root = ? AND dir = ?", (self.root, start_rel)
+        ).fetchone()
+        if exists is None:
+            raise ValueError(
+                f"{start_dir} is not in the index of {self.root}, "
+                + "try calling refresh first"
+            )
+
+        def strip(rel_dir):
+            return rel_dir[len(start_rel) + 1 :] if start_rel != "" else rel_dir
+
+        stack = [start_rel]
+        while stack:
+            rel_dir = stack.pop()
+            children = sorted(self._children(rel_dir))
+            filenames = sorted(
+                name
+                for (name,) in self._conn.execute(
+                    "SELECT name FROM files WHERE root = ? AND dir = ?",
+                    (self.root, rel_dir),
+                )
+            )
+            yield strip(rel_dir), [os.path.basename(d) for d in children], filenames
+            if not recursive:
+                return
+            if dir_filter is not None:
+                children = [d for d in children if dir_filter(strip(d))]
+            stack.extend(children[::-1])
+
+    def file_info(self, path):
+        """
+        Get the indexed size and modification time of a file.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file, must be inside the index root.
+
+        Returns
+        -------
+        tuple of (int, int) or None
+            The size in bytes and the mtime in nanoseconds,
+            or None if the file is not in the index.
+
+        """
+        rel_path = self._relative(path)
+        return self._conn.execute(
+            "SELECT size, mtime FROM files WHERE root = ? AND dir = ? AND name = ?",
+            (self.root, os.path.dirname(rel_path), os.path.basename(rel_path)),
+        ).fetchone()
+
+    def _relative(self, path):
+        if path is None:
+            return ""
+        rel_path = os.path.relpath(os.path.abspath(path), self.root)
+        if rel_path == os.curdir:
+            return ""
+        if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+            raise ValueError(f"{path} is not inside the index root {self.root}")
+        return rel_path
+
+    def _children(self, rel_dir):
+        return [
+            d
+            for (d,) in self._conn.execute(
+                "SELECT dir FROM dirs WHERE root = ? AND parent = ?",
+                (self.root, rel_dir),
+            )
+        ]
+
+    def _remove_tree(self, rel_dir):
+        prefix = rel_dir + os.sep
+        for table in ("dirs", "files"):
+            self._conn.execute(
+                f"DELETE FROM {table} WHERE root = ? "
+                + "AND (dir = ? OR substr(dir, 1, ?) = ?)",
+                (self.root, rel_dir, len(prefix), prefix),
+            )
+
+
+class ContentHashIndex:
+    """
+    An on-disk cache of file content hashes.
+
+    Hashes are computed with path.file_hash (chunked BLAKE2b),
+    and stored with the size and mtime of the file when it was hashed,
+    so a file is only read again once it has changed.
+
+    Parameters
+    ----------
+    location : str, optional
+        The path to the SQLite database,
+        by default home/.skm_python/hash_index.sqlite.
+    workers : int, optional
+        The number of threads used to hash files in digests, by default 1.
+
+    """
+
+    def __init__(self, location=None, workers=1):
+        if location is None:
+            location = get_default_index_loc("hash_index.sqlite")
+        self.location = location
+        self.workers = workers
+        make_path_if_not_exists(self.location)
+        self._conn = sqlite3.connect(self.location)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            + "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, digest TEXT)"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"ContentHashIndex(location={self.location!r})"
+
+    def close(self):
+        """Save any new hashes and close the connection to the database."""
+        self._conn.commit()
+        self._conn.close()
+
+    def cached_digest(self, path):
+        """Return the stored hash of path if it is up to date, else None."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self._conn.execute(
+            "SELECT size, mtime, digest FROM hashes WHERE path = ?", (path,)
+        ).fetchone()
+        if row is not None and row[:2] == (st.st_size, st.st_mtime_ns):
+            return row[2]
+        return None
+
+    def set_digest(self, path, digest):
+        """Store the hash of path, e.g. for a file that was just written."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, digest),
+        )
+
+    def digest(self, path):
+        """Return the hash of the contents of path, reading it if needed."""
+        digest = self.cached_digest(path)
+        if digest is None:
+            digest = file_hash(path)
+            self.set_digest(path, digest)
+        return digest
+
+    def digests(self, paths):
+        """
+        Return the hashes of many files, reading changed files in parallel.
+
+        Parameters
+        ----------
+        paths : iterable of str
+            The paths to the files.
+
+        Returns
+        -------
+        dict
+            A mapping from each path to its hash.
+
+        """
+        out = {}
+        to_hash = []
+        for path in dict.fromkeys(paths):
+            digest = self.cached_digest(path)
+            if digest is None:
+                to_hash.append(path)
+            else:
+                out[path] = digest
+        if self.workers is None or self.workers <= 1:
+            hashed = map(file_hash, to_hash)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                hashed = list(pool.map(file_hash, to_hash))
+        for path, digest in zip(to_hash, hashed):
+            self.set_digest(path, digest)
+            out[path] = digest
+        self._conn.commit()
+        return out
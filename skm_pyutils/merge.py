@@ -1,17 +1,29 @@
 """This module holds routine for merging outputs files and folders."""
 
 import argparse
+import csv
+import io
+import json
 import os
 import re
 import shutil
-import warnings
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
 
 import numpy as np
+import pandas as pd
 
-from skm_pyutils.path import get_all_files_in_dir
+from skm_pyutils.array import RunningStats
+from skm_pyutils.compression import COMPRESSION_SUFFIXES, open_file, path_or_open_file
+from skm_pyutils.index import ContentHashIndex
+from skm_pyutils.path import iter_files_in_dir
+from skm_pyutils.table import ChunkedTableWriter
+from skm_pyutils.transfer import CopyStats, copy_file, copy_files
 
 
-def merge_files(in_dir, all_result_ext=None):
+def merge_files(in_dir, all_result_ext=None, jobs=1, dedup=False):
     """
     Merge all files with the given extension recursively from in_dir.
 
@@ -21,6 +33,14 @@ def merge_files(in_dir, all_result_ext=None):
         The path to where to start merging from.
     all_result_ext : str, optional
         The extension to look for, by default None, which takes all
+    jobs : int, optional
+        The number of files to copy at once, by default 1.
+        Files already merged with the same size and mtime are skipped.
+    dedup : bool, optional
+        Compare file contents using a cached content hash index,
+        by default False. Files already merged with the same contents
+        are skipped, and files with the same contents as another merged
+        file are hard linked to it instead of copied.
 
     Returns
     -------
@@ -35,33 +55,519 @@ def merge_files(in_dir, all_result_ext=None):
         for o in os.listdir(in_dir)
         if os.path.isdir(os.path.join(in_dir, o)) and o != "all_results_merged"
     ]
+    pairs = _merge_pairs(in_dir, dirs, all_file_loc, all_result_ext)
+    if dedup:
+        _dedup_copy_files(pairs, all_file_loc, jobs=jobs)
+    else:
+        copy_files(pairs, jobs=jobs)
+
+
+def _merge_pairs(in_dir, dirs, all_file_loc, all_result_ext):
+    """Yield (source, destination) pairs of files to merge from dirs."""
+    abs_in_dir = os.path.abspath(in_dir)
     for d in dirs:
-        name = d[len(in_dir) :]
-        name = "--".join(name.split(os.sep))
-        # print("Copying contents of {}".format(d))
-        all_files = get_all_files_in_dir(
+        all_files = iter_files_in_dir(
             d, ext=all_result_ext, recursive=True, return_absolute=True
         )
         if all_result_ext is None:
-            all_files = [
+            all_files = (
                 f
                 for f in all_files
                 if os.path.splitext(f)[1]
                 in [".png", ".jpg", ".svg", ".png", ".gif", ".tiff"]
-            ]
+            )
+
+        for f in all_files:
+            o_name = "--".join(os.path.relpath(f, abs_in_dir).split(os.sep))
+            yield f, os.path.join(all_file_loc, o_name)
+
+
+def _dedup_copy_files(pairs, out_dir, jobs=1, batch_size=256):
+    """
+    Copy files into out_dir, skipping unchanged files and linking duplicates.
+
+    Sizes are compared first, and contents are only hashed when a file in
+    out_dir or in the same batch has the same size. Each batch of pairs
+    is hashed in parallel and then copied in parallel with
+    transfer.copy_files.
+
+    Parameters
+    ----------
+    pairs : iterable of (str, str)
+        The (source, destination) paths, destinations must be in out_dir.
+    out_dir : str
+        The directory being merged into.
+    jobs : int, optional
+        The number of files to hash and copy at once, by default 1.
+    batch_size : int, optional
+        The number of pairs to process at once, by default 256.
+
+    Returns
+    -------
+    CopyStats
+        Counts of what was done and the throughput.
+
+    Raises
+    ------
+    OSError
+        If any copy failed, once every pair is done.
+
+    """
+    size_of = {}
+    by_size = {}
+    with os.scandir(out_dir) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                size = entry.stat().st_size
+                size_of[entry.path] = size
+                by_size.setdefault(size, set()).add(entry.path)
 
-        all_names = [
-            "--".join(f[len(in_dir + os.sep) :].split(os.sep)) for f in all_files
-        ]
-        for f, o_name in zip(all_files, all_names):
-            out_name = os.path.join(all_file_loc, o_name)
-            shutil.copy(f, out_name)
+    stats = CopyStats()
+    start_time = perf_counter()
+    pairs = iter(pairs)
+    with ContentHashIndex(workers=jobs) as hashes:
+        while True:
+            batch = list(islice(pairs, batch_size))
+            if len(batch) == 0:
+                break
+            infos = []
+            for src, dst in batch:
+                try:
+                    size = os.path.getsize(src)
+                except OSError as e:
+                    stats.failed += 1
+                    print(f"Failed to copy {src}: {e}")
+                    continue
+                infos.append((src, dst, size))
+            # Only files with the same size as another file are hashed
+            batch_sizes = Counter(size for _, _, size in infos)
+            to_hash = []
+            for src, _, size in infos:
+                if size in by_size or batch_sizes[size] > 1:
+                    to_hash.append(src)
+                    to_hash.extend(by_size.get(size, ()))
+            hashes.digests(to_hash)
 
+            # Files to be written in this batch are hashed through their source
+            pending = {}
 
-def csv_merge(in_dir, keep_headers=True, insert_newline=True, stats=True, delim=","):
+            def digest_of(path):
+                return hashes.digest(pending.get(path, path))
+
+            to_copy, to_link = [], []
+            for src, dst, size in infos:
+                candidates = sorted(by_size.get(size, ()))
+                if len(candidates) > 0:
+                    src_digest = digest_of(src)
+                    if dst in candidates and digest_of(dst) == src_digest:
+                        stats.skipped += 1
+                        continue
+                    matches = (
+                        c for c in candidates if c != dst and digest_of(c) == src_digest
+                    )
+                    match = next(matches, None)
+                else:
+                    match = None
+                if dst in size_of:
+                    by_size[size_of[dst]].discard(dst)
+                size_of[dst] = size
+                by_size.setdefault(size, set()).add(dst)
+                pending[dst] = src
+                if match is None:
+                    to_copy.append((src, dst))
+                else:
+                    to_link.append((match, dst))
+
+            stats.add(
+                copy_files(
+                    to_copy,
+                    jobs=jobs,
+                    skip_up_to_date=False,
+                    verbose=False,
+                    raise_on_error=False,
+                )
+            )
+            for match, dst in to_link:
+                try:
+                    if os.path.lexists(dst):
+                        os.remove(dst)
+                    os.link(match, dst)
+                    stats.linked += 1
+                except OSError:
+                    # match may be a destination whose copy failed above
+                    try:
+                        copy_file(match, dst, skip_up_to_date=False)
+                        stats.copied += 1
+                    except OSError as e:
+                        stats.failed += 1
+                        print(f"Failed to copy {match}: {e}")
+            for dst, src in pending.items():
+                if os.path.exists(dst):
+                    # Unhashed outputs are hashed by a later run if needed
+                    digest = hashes.cached_digest(src)
+                    if digest is not None:
+                        hashes.set_digest(dst, digest)
+                else:
+                    # The copy failed, so dst can't be linked to later
+                    by_size[size_of.pop(dst)].discard(dst)
+
+    stats.seconds = perf_counter() - start_time
+    print(stats)
+    if stats.failed > 0:
+        raise OSError(f"Failed to copy {stats.failed} files")
+    return stats
+
+
+# The fields that the statistics of csv_merge treat as NaN
+_QUOTED_FIELD = re.compile('"[^"]+"')
+
+
+def _csv_file_stats(filename, data_start_col=2, chunksize=100000, quantiles=False):
+    """
+    Compute statistics of the numeric columns of a csv in one pass.
+
+    The file is parsed in chunks with pandas, so memory use is bounded.
+    Quoted fields, even quoted numbers, and other non numeric values
+    count as NaN.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the csv file, the first line is a header.
+    data_start_col : int, optional
+        The first column to compute statistics of, by default 2.
+    chunksize : int, optional
+        The number of rows to parse at a time, by default 100000.
+    quantiles : bool, optional
+        Also keep quantile sketches of each column, by default False.
+
+    Returns
+    -------
+    columns : tuple of str
+        The header names of the columns with statistics.
+    running : RunningStats or None
+        The statistics, or None if the file has no data rows.
+    total : float
+        The sum of all values, NaN if any value is NaN.
+    last_sum : float
+        The sum of the values in the last row.
+
+    """
+    running = RunningStats(quantiles=quantiles)
+    total = 0.0
+    last_row = None
+    with open_file(filename, "r", newline="") as f:
+        header = next(csv.reader([f.readline()]), [])
+        for lines in iter(lambda: list(islice(f, chunksize)), []):
+            text = _QUOTED_FIELD.sub("NAN", "".join(lines))
+            try:
+                chunk = pd.read_csv(
+                    io.StringIO(text), header=None, float_precision="round_trip"
+                )
+            except pd.errors.EmptyDataError:
+                continue
+            data = chunk.iloc[:, data_start_col:]
+            data = data.apply(pd.to_numeric, errors="coerce")
+            data = data.to_numpy(dtype=float)
+            if data.shape[0] == 0:
+                continue
+            running.update(data)
+            total += np.sum(data)
+            last_row = data[-1]
+    columns = tuple(header[data_start_col:])
+
+    if last_row is None:
+        return columns, None, total, 0.0
+    return columns, running, total, np.sum(last_row)
+
+
+def _stats_rows(running, total, last_sum):
+    """Format the Average and Std rows written after each merged csv."""
+    if running is None or total == 0:
+        return ""
+    if last_sum == 0:
+        raise RuntimeError("Excel sheet to merge has trailing blank lines")
+    avg_str = "Average," + "," + ",".join(str(val) for val in running.mean) + "\n"
+    std_str = "Std," + "," + ",".join(str(val) for val in running.std) + "\n"
+    return avg_str + std_str
+
+
+def _iter_csv_stats(csv_files, data_start_col=2, workers=1, quantiles=False):
+    """
+    Yield each csv file with its _csv_file_stats, in the order given.
+
+    With more than one worker the files are summarised in a process pool.
+    At most 2 * workers files are in flight, so the results held in memory
+    stay bounded however far the pool could get ahead of the caller.
+
+    """
+    if workers is None or workers <= 1:
+        for f in csv_files:
+            yield f, _csv_file_stats(
+                f, data_start_col=data_start_col, quantiles=quantiles
+            )
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for f in csv_files:
+            future = pool.submit(
+                _csv_file_stats, f, data_start_col=data_start_col, quantiles=quantiles
+            )
+            pending.append((f, future))
+            if len(pending) >= 2 * workers:
+                f, future = pending.popleft()
+                yield f, future.result()
+        while pending:
+            f, future = pending.popleft()
+            yield f, future.result()
+
+
+def _csv_to_columnar(writer, filename, source, header, data_start_col=2):
+    """
+    Append the rows of a csv to a ChunkedTableWriter.
+
+    A "Source" column holding source is added first, the columns before
+    data_start_col are kept as strings, and the rest are converted to
+    floats as in the statistics, so every file has the same schema.
+    Files with a header different to header are skipped.
+
+    """
+    with open_file(filename, "r", newline="") as f:
+        this_header = next(csv.reader(f), [])
+    if this_header != header:
+        print(f"Skipping {filename} in columnar output, its header differs")
+        return
+    try:
+        with path_or_open_file(filename) as csv_source:
+            reader = pd.read_csv(csv_source, dtype=str, chunksize=100000)
+            for chunk in reader:
+                # Duplicate names in the header are made unique by read_csv
+                n_rows = len(chunk)
+                columns = {"Source": pd.array([source] * n_rows, dtype="string")}
+                for i, name in enumerate(chunk.columns):
+                    values = chunk.iloc[:, i]
+                    if i < data_start_col:
+                        columns[name] = values.astype("string")
+                    else:
+                        values = pd.to_numeric(values, errors="coerce")
+                        columns[name] = values.astype(float)
+                writer.write(pd.DataFrame(columns))
+    except pd.errors.EmptyDataError:
+        return
+
+
+def _write_aggregates(filename, totals, aggregates, quantiles):
+    """
+    Write the combined statistics of groups of merged csv files.
+
+    Parameters
+    ----------
+    filename : str
+        The path to write to.
+    totals : dict
+        Maps column names to the RunningStats of all files with them,
+        written as the group All before the other groups.
+    aggregates : dict
+        Maps (group name, column names) to the RunningStats of the group.
+        Groups with the same columns are written under one header.
+    quantiles : list of float
+        The quantiles to estimate for each column.
+
+    Returns
+    -------
+    None
+
+    """
+    by_columns = OrderedDict()
+    for columns, running in totals.items():
+        by_columns[columns] = [("All", running)]
+    for (group, columns), running in aggregates.items():
+        by_columns.setdefault(columns, []).append((group, running))
+
+    print("Writing aggregate statistics to {}".format(filename))
+    with open(filename, "w") as output:
+        for i, (columns, groups) in enumerate(by_columns.items()):
+            if i != 0:
+                output.write("\n")
+            output.write("Group,Statistic," + ",".join(columns) + "\n")
+            for group, running in groups:
+                rows = [
+                    ("Count", running.count),
+                    ("Mean", running.mean),
+                    ("Std", running.std),
+                    ("Min", running.min),
+                    ("Max", running.max),
+                ]
+                rows += [(f"Q{q:g}", running.quantile(q)) for q in quantiles]
+                for name, values in rows:
+                    output.write(
+                        f"{group},{name}," + ",".join(str(v) for v in values) + "\n"
+                    )
+
+
+def _write_csv_entry(
+    output, filename, summary, first, keep_headers, insert_newline, stats
+):
+    """
+    Write one csv file and its statistics rows to output.
+
+    Returns the manifest entry of the file, with its size and mtime,
+    and where it starts and ends in output.
+
+    """
+    st = os.stat(filename)
+    start = output.tell()
+    with open_file(filename, "r") as in_file:
+        if not (keep_headers or first):
+            in_file.readline()
+        shutil.copyfileobj(in_file, output)
+
+    if stats:
+        output.write(_stats_rows(*summary[1:]))
+
+    if insert_newline:
+        output.write("\n")
+
+    return {
+        "path": filename,
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        "start": start,
+        "end": output.tell(),
+    }
+
+
+def _load_manifest(m_name, o_name, options):
+    """Load the manifest entries of o_name, or None if they can't be used."""
+    try:
+        with open(m_name, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("options") != options:
+        return None
+    if not os.path.isfile(o_name) or os.path.getsize(o_name) != manifest.get("size"):
+        return None
+    return manifest["files"]
+
+
+def _save_manifest(m_name, o_name, options, entries):
+    """Save the manifest entries of o_name."""
+    manifest = {"options": options, "size": os.path.getsize(o_name), "files": entries}
+    with open(m_name, "w") as f:
+        json.dump(manifest, f)
+
+
+def _is_unchanged(entry):
+    """Return True if the file of a manifest entry has the same size and mtime."""
+    try:
+        st = os.stat(entry["path"])
+    except OSError:
+        return False
+    return st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime"]
+
+
+def _csv_merge_incremental(csv_files, o_name, options, summarise, write_entry):
+    """
+    Update a merged csv, only parsing new and changed files.
+
+    Parameters
+    ----------
+    csv_files : iterable of str
+        The csv files currently in the tree, in merge order.
+    o_name : str
+        The path to the merged output.
+    options : dict
+        The options used to merge, stored in the manifest.
+        If they differ from the previous merge, the output is rebuilt.
+    summarise : callable
+        Maps an iterable of files to (file, summary) pairs, in order.
+    write_entry : callable
+        Writes a file and its summary to output, see _write_csv_entry.
+
+    Returns
+    -------
+    None
+
+    """
+    m_name = o_name + ".manifest.json"
+    csv_files = list(csv_files)
+    old = _load_manifest(m_name, o_name, options)
+    old_paths = set() if old is None else {e["path"] for e in old}
+    current = set(csv_files)
+    kept = [] if old is None else [e for e in old if e["path"] in current]
+    new_files = [f for f in csv_files if f not in old_paths]
+    changed = {e["path"] for e in kept if not _is_unchanged(e)}
+
+    if old is None or (
+        not options["keep_headers"] and (len(kept) == 0 or kept[0] is not old[0])
+    ):
+        # Full rebuild, the first file must also keep its header
+        print("Rebuilding {}".format(o_name))
+        with open(o_name, "w") as output:
+            entries = [
+                write_entry(output, f, summary, i == 0)
+                for i, (f, summary) in enumerate(summarise(csv_files))
+            ]
+    elif len(changed) == 0 and len(kept) == len(old):
+        print("Appending {} new files to {}".format(len(new_files), o_name))
+        with open(o_name, "a") as output:
+            entries = kept + [
+                write_entry(output, f, summary, False)
+                for f, summary in summarise(new_files)
+            ]
+    else:
+        print(
+            "Updating {} changed, {} removed and {} new files in {}".format(
+                len(changed), len(old) - len(kept), len(new_files), o_name
+            )
+        )
+        order = [e["path"] for e in kept] + new_files
+        to_parse = summarise(f for f in order if f in changed or f not in old_paths)
+        old_entries = {e["path"]: e for e in kept}
+        temp_name = o_name + ".tmp"
+        entries = []
+        with open(o_name, "rb") as old_output, open(temp_name, "w") as output:
+            for i, f in enumerate(order):
+                if f in old_entries and f not in changed:
+                    # Copy the unchanged bytes over without parsing again
+                    entry = dict(old_entries[f])
+                    old_output.seek(entry["start"])
+                    length = entry["end"] - entry["start"]
+                    output.flush()
+                    entry["start"] = output.tell()
+                    output.buffer.write(old_output.read(length))
+                    entry["end"] = output.tell()
+                    entries.append(entry)
+                else:
+                    parsed_f, summary = next(to_parse)
+                    entries.append(write_entry(output, parsed_f, summary, i == 0))
+        os.replace(temp_name, o_name)
+    _save_manifest(m_name, o_name, options, entries)
+
+
+def csv_merge(
+    in_dir,
+    keep_headers=True,
+    insert_newline=True,
+    stats=True,
+    delim=",",
+    workers=1,
+    aggregate=False,
+    group_depth=1,
+    quantiles=(0.05, 0.25, 0.5, 0.75, 0.95),
+    incremental=False,
+    columnar=None,
+):
     """
     Merge all csv files recursively from in_dir into one file.
 
+    Each file is streamed into the output, and the statistics are
+    computed in chunks, so large files are merged in bounded memory.
+    Compressed csv files, such as .csv.gz or .csv.zst, are included
+    and decompressed as they are streamed.
+
     Parameters
     ----------
     in_dir : str
@@ -74,84 +580,127 @@ def csv_merge(in_dir, keep_headers=True, insert_newline=True, stats=True, delim=
         Do average and std of numerical values, by default True
     delim : str, optional
         What delimiter to use, by default ","
+    workers : int, optional
+        The number of processes used to compute statistics, by default 1.
+        The output order does not depend on the number of workers.
+    aggregate : bool, optional
+        Also write the count, mean, std, min, max and approximate quantiles
+        of all files, and of each directory group, to
+        merge--<dir>--aggregate.csv, by default False.
+        These are combined from the per file statistics in the same pass.
+        Files are only combined with files that have the same header.
+    group_depth : int, optional
+        The number of leading subdirectories of in_dir that name a group
+        for aggregate, by default 1. Files directly in in_dir are in group ".".
+    quantiles : list of float, optional
+        The quantiles written for aggregate, by default
+        (0.05, 0.25, 0.5, 0.75, 0.95). They are accurate to within 1%.
+    incremental : bool, optional
+        Update the output using a sidecar manifest of the merged files,
+        merge--<dir>.csv.manifest.json, by default False.
+        Unchanged files are not parsed again, new files are appended,
+        and changed or removed files only cause their part of the output
+        to be rewritten. Can't be used with aggregate.
+    columnar : str, optional
+        Also write all rows to merge--<dir> with this extension,
+        ".parquet", ".feather" or ".arrow", by default None.
+        A "Source" column holds the path of each row's file, and the
+        numeric columns are stored as floats. Files with a different
+        header to the first file are left out.
+        Can't be used with incremental.
 
     Returns
     -------
     None
 
+    Raises
+    ------
+    ValueError
+        If incremental is used with aggregate or columnar,
+        or columnar is not a supported extension.
+
     """
+    if incremental and (aggregate or columnar is not None):
+        raise ValueError(
+            "aggregate and columnar are not supported with incremental merging"
+        )
+    if columnar is not None and columnar not in (".parquet", ".feather", ".arrow"):
+        raise ValueError(f"Unsupported columnar extension {columnar}")
     data_start_col = 2
-    csv_files = get_all_files_in_dir(in_dir, ext="csv", recursive=True)
+    csv_exts = ["csv"] + ["csv" + suffix for suffix in COMPRESSION_SUFFIXES]
+    csv_files = iter_files_in_dir(in_dir, ext=csv_exts, recursive=True)
     try:
         o_name = os.path.join(in_dir, f"merge--{os.path.basename(in_dir)}.csv")
     except BaseException:
         o_name = os.path.join(in_dir, f"merge.csv")
+    a_name = os.path.splitext(o_name)[0] + "--aggregate.csv"
     print("Merging csv results into {}".format(o_name))
-    if os.path.isfile(o_name):
-        csv_files = csv_files[1:]
+    # The outputs are written while scanning, so skip them by name
+    outputs = (os.path.abspath(o_name), os.path.abspath(a_name))
+    csv_files = (f for f in csv_files if f not in outputs)
+
+    def summarise(files):
+        if stats or aggregate:
+            return _iter_csv_stats(
+                files,
+                data_start_col=data_start_col,
+                workers=workers,
+                quantiles=aggregate,
+            )
+        return ((f, ((), None, 0.0, 0.0)) for f in files)
+
+    def write_entry(output, f, summary, first):
+        return _write_csv_entry(
+            output, f, summary, first, keep_headers, insert_newline, stats
+        )
+
+    if incremental:
+        options = {
+            "keep_headers": keep_headers,
+            "insert_newline": insert_newline,
+            "stats": stats,
+            "data_start_col": data_start_col,
+        }
+        _csv_merge_incremental(csv_files, o_name, options, summarise, write_entry)
+        return
+
+    # A full merge makes any previous manifest out of date
+    if os.path.isfile(o_name + ".manifest.json"):
+        os.remove(o_name + ".manifest.json")
+    abs_in_dir = os.path.abspath(in_dir)
+    # Kept apart from the groups, as a directory may be named All
+    totals = OrderedDict()
+    aggregates = OrderedDict()
+    columnar_writer = None
+    if columnar is not None:
+        c_name = os.path.splitext(o_name)[0] + columnar
+        print("Writing columnar merged results to {}".format(c_name))
+        columnar_writer = ChunkedTableWriter(c_name)
     with open(o_name, "w") as output:
-        for i, f in enumerate(csv_files):
-            # print("Merging {}".format(f))
-            with open(f, "r") as open_file:
-                file_data = open_file.read()
-                lines = file_data.split("\n")
-                if keep_headers or (i == 0):
-                    for i, line in enumerate(lines):
-                        output.write(line)
-                        if i != len(lines) - 1:
-                            output.write("\n")
-                else:
-                    for i, line in enumerate(lines[1:]):
-                        output.write(line)
-                        if i != len(lines) - 2:
-                            output.write("\n")
-
-                if stats:
-                    file_data = re.sub('"[^"]+"', "NAN", file_data)
-                    lines = file_data.split("\n")[:-1]
-                    split_up = []
-                    for line in lines[1:]:
-                        if line != "":
-                            split_up.append(line.split(",")[data_start_col:])
-                    data = np.zeros(shape=(len(split_up), len(split_up[0])))
-                    for i, row in enumerate(split_up):
-                        for j, val in enumerate(row):
-                            try:
-                                to_write = float(val.strip())
-                            except BaseException:
-                                to_write = np.nan
-                            data[i, j] = to_write
-                    if np.sum(data) == 0:
-                        # print("No data to average in merge")
-                        # Added pass to make code valid
-                        pass
-                    else:
-                        check = data[-1]
-                        if np.sum(check) == 0:
-                            raise RuntimeError(
-                                "Excel sheet to merge has trailing blank lines"
-                            )
-                        with warnings.catch_warnings():
-                            warnings.filterwarnings(
-                                action="ignore", message="Mean of empty slice"
-                            )
-                            warnings.filterwarnings(
-                                action="ignore",
-                                message="Degrees of freedom <= 0 for slice.",
-                            )
-                            avg = np.nanmean(data, axis=0)
-                            std = np.nanstd(data, axis=0)
-                        avg_str = (
-                            "Average," + "," + ",".join(str(val) for val in avg) + "\n"
-                        )
-                        std_str = (
-                            "Std," + "," + ",".join(str(val) for val in std) + "\n"
-                        )
-                        output.write(avg_str)
-                        output.write(std_str)
-
-                if insert_newline:
-                    output.write("\n")
+        for i, (f, summary) in enumerate(summarise(csv_files)):
+            write_entry(output, f, summary, i == 0)
+
+            if columnar_writer is not None:
+                if i == 0:
+                    with open_file(f, "r", newline="") as in_file:
+                        header = next(csv.reader(in_file), [])
+                source = os.path.relpath(f, abs_in_dir)
+                _csv_to_columnar(columnar_writer, f, source, header, data_start_col)
+
+            columns, running = summary[:2]
+            if aggregate and running is not None:
+                parts = os.path.relpath(os.path.dirname(f), abs_in_dir).split(os.sep)
+                group = "/".join(parts[:group_depth])
+                keys = ((totals, columns), (aggregates, (group, columns)))
+                for accumulator, key in keys:
+                    if key not in accumulator:
+                        accumulator[key] = RunningStats(quantiles=True)
+                    accumulator[key].combine(running)
+
+    if columnar_writer is not None:
+        columnar_writer.close()
+    if aggregate:
+        _write_aggregates(a_name, totals, aggregates, quantiles)
 
 
 def cli():
@@ -171,6 +720,42 @@ def cli():
         default=None,
         help="the image extension to look for (without .)",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="the number of images to copy at once",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="the number of processes used to summarise csv files",
+    )
+    parser.add_argument(
+        "--aggregate",
+        "-a",
+        action="store_true",
+        help="also write statistics of all csv files and each directory",
+    )
+    parser.add_argument(
+        "--columnar",
+        type=str,
+        default=None,
+        help="also write merged rows to a .parquet, .feather or .arrow file",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only parse new and changed csv files since the last merge",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="skip unchanged images and hard link duplicates by content hash",
+    )
 
     parsed, unparsed = parser.parse_known_args()
     if len(unparsed) > 0:
@@ -178,11 +763,22 @@ def cli():
 
     if parsed.do_csv:
         print("----------CSV MERGE-----------")
-        csv_merge(parsed.directory)
+        csv_merge(
+            parsed.directory,
+            workers=parsed.workers,
+            aggregate=parsed.aggregate,
+            incremental=parsed.incremental,
+            columnar=parsed.columnar,
+        )
 
     if parsed.do_images:
         print("----------IMAGE MERGE-----------")
-        merge_files(parsed.directory, all_result_ext=parsed.image_extension)
+        merge_files(
+            parsed.directory,
+            all_result_ext=parsed.image_extension,
+            jobs=parsed.jobs,
+            dedup=parsed.dedup,
+        )
 
 
 if __name__ == "__main__":
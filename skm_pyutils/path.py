@@ -1,12 +1,15 @@
 """Path related utility functions."""
 import argparse
+import fnmatch
+import hashlib
 import os
 import re
-import shutil
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
 
 from skm_pyutils.config import parse_args
+from skm_pyutils.transfer import copy_files
 
 
 def make_path_if_not_exists(fname):
@@ -49,6 +52,343 @@ def has_ext(filename, ext, case_sensitive_ext=False):
         return filename[-len(ext) :].lower() == ext.lower()
 
 
+def file_hash(filename, chunk_size=1 << 20):
+    """
+    Get the BLAKE2b hash of the contents of a file.
+
+    The file is read in chunks, so large files use bounded memory.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the file.
+    chunk_size : int, optional. Defaults to 1 MiB.
+        The number of bytes to read at a time.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the file contents.
+
+    """
+    hasher = hashlib.blake2b()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _to_list(val):
+    """Convert None, a single string, or an iterable to a list."""
+    if val is None:
+        return []
+    if isinstance(val, str):
+        return [val]
+    return list(val)
+
+
+class PathFilter:
+    """
+    A reusable filter for relative file and directory paths.
+
+    All regular expressions and glob patterns are compiled once on creation,
+    and the extensions are normalised once, so the filter is cheap to
+    apply to millions of paths.
+    Paths are matched with "/" as the separator on all platforms.
+
+    Parameters
+    ----------
+    ext : str or list of str, optional. Defaults to None.
+        The extensions to keep, may have leading dot (e.g txt == .txt).
+        None keeps all extensions.
+    re_filter : str or list of str, optional. Defaults to None.
+        Regular expressions which must all be found in the path.
+    include : str or list of str, optional. Defaults to None.
+        Glob patterns, a file must match at least one to be kept.
+    exclude : str or list of str, optional. Defaults to None.
+        Glob patterns, a file matching any of these is skipped.
+    prune : str or list of str, optional. Defaults to None.
+        Glob patterns for directories that should not be descended into,
+        e.g. "__pycache__" or ".git".
+    case_sensitive_ext : bool, optional. Defaults to False.
+        Whether to match the case of the file extension.
+
+    Notes
+    -----
+    Glob patterns are matched against both the name and the relative
+    path, so "*.png" and "results/*.png" both work as expected.
+
+    """
+
+    def __init__(
+        self,
+        ext=None,
+        re_filter=None,
+        include=None,
+        exclude=None,
+        prune=None,
+        case_sensitive_ext=False,
+    ):
+        self.case_sensitive_ext = case_sensitive_ext
+        exts = ["." + e if not e.startswith(".") else e for e in _to_list(ext)]
+        if not case_sensitive_ext:
+            exts = [e.lower() for e in exts]
+        self.exts = tuple(sorted(set(exts))) if len(exts) > 0 else None
+        self._ext_len = max((len(e) for e in exts), default=0)
+        self.regexes = [re.compile(r) for r in _to_list(re_filter)]
+        self._include = self._compile_globs(include)
+        self._exclude = self._compile_globs(exclude)
+        self._prune = self._compile_globs(prune)
+
+    @staticmethod
+    def _compile_globs(patterns):
+        patterns = _to_list(patterns)
+        if len(patterns) == 0:
+            return None
+        return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+    @staticmethod
+    def _match_glob(pattern, path):
+        return (
+            pattern.match(path) is not None
+            or pattern.match(path.rsplit("/", 1)[-1]) is not None
+        )
+
+    def match_ext(self, filename):
+        """Return True if filename has one of the extensions."""
+        if self.exts is None:
+            return True
+        end = filename[-self._ext_len :]
+        if not self.case_sensitive_ext:
+            end = end.lower()
+        return end.endswith(self.exts)
+
+    def match_regex(self, path):
+        """Return True if all of the regular expressions are found in path."""
+        if os.sep != "/":
+            path = path.replace(os.sep, "/")
+        return all(r.search(path) is not None for r in self.regexes)
+
+    def match_file(self, path):
+        """Return True if the relative file path passes the filter."""
+        if not self.match_ext(path):
+            return False
+        if os.sep != "/":
+            path = path.replace(os.sep, "/")
+        if self._include is not None and not self._match_glob(self._include, path):
+            return False
+        if self._exclude is not None and self._match_glob(self._exclude, path):
+            return False
+        return all(r.search(path) is not None for r in self.regexes)
+
+    def match_dir(self, path):
+        """Return True if the relative directory path should be descended into."""
+        if self._prune is None:
+            return True
+        if os.sep != "/":
+            path = path.replace(os.sep, "/")
+        return not self._match_glob(self._prune, path)
+
+    def __call__(self, path):
+        return self.match_file(path)
+
+    def __repr__(self):
+        return (
+            f"PathFilter(exts={self.exts}, "
+            f"re_filter={[r.pattern for r in self.regexes]})"
+        )
+
+
+def _scan_dir(path):
+    """
+    Scan a single directory, returning sorted subdirectory and file entries.
+
+    The type information cached on each os.DirEntry is used, so no extra
+    stat call is needed per entry on most platforms.
+    As in os.walk, symlinks to directories are reported as directories,
+    while broken symlinks are not reported as files.
+
+    """
+    dirs, files = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        dirs.append(entry)
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:
+                    continue
+    except OSError:
+        return dirs, files
+    dirs.sort(key=lambda e: e.name)
+    files.sort(key=lambda e: e.name)
+    return dirs, files
+
+
+def walk_dir(start_dir, recursive=True, workers=1, dir_filter=None):
+    """
+    Walk a directory tree top-down using os.scandir.
+
+    Similar to os.walk, but the yielded roots are relative to start_dir,
+    entries are sorted by name, and subdirectories are visited
+    depth first in sorted order, so the output is deterministic.
+    Symlinks to directories are listed but not followed.
+
+    Parameters
+    ----------
+    start_dir : str
+        The path to the directory to start at.
+    recursive : bool, optional. Defaults to True.
+        Whether to recurse through directories.
+    workers : int, optional. Defaults to 1.
+        The number of threads used to scan directories.
+        If more than 1, subdirectories are scanned ahead of time
+        on a thread pool, which helps on high latency file systems.
+    dir_filter : callable, optional. Defaults to None.
+        Called with the relative path of each subdirectory,
+        if it returns False the whole subtree is skipped.
+        PathFilter.match_dir can be used here.
+
+    Yields
+    ------
+    tuple of (str, list of str, list of str)
+        The relative root, the directory names and the file names.
+
+    """
+    if not recursive:
+        dirs, files = _scan_dir(start_dir)
+        yield "", [d.name for d in dirs], [f.name for f in files]
+        return
+
+    def children(rel_root, dirs):
+        rel_dirs = [
+            os.path.join(rel_root, d.name) for d in dirs if not d.is_symlink()
+        ]
+        if dir_filter is not None:
+            rel_dirs = [d for d in rel_dirs if dir_filter(d)]
+        return rel_dirs[::-1]
+
+    if workers is None or workers <= 1:
+        stack = [""]
+        while stack:
+            rel_root = stack.pop()
+            dirs, files = _scan_dir(os.path.join(start_dir, rel_root))
+            yield rel_root, [d.name for d in dirs], [f.name for f in files]
+            stack.extend(children(rel_root, dirs))
+        return
+
+    # Only the directories to be visited next are scanned ahead,
+    # so memory use does not grow with the width of the tree
+    max_ahead = 4 * workers
+    pool = ThreadPoolExecutor(max_workers=workers)
+    stack = [["", None]]
+    n_ahead = 0
+    try:
+        while stack:
+            # The top of the stack is visited first
+            for item in reversed(stack):
+                if n_ahead >= max_ahead:
+                    break
+                if item[1] is None:
+                    item[1] = pool.submit(_scan_dir, os.path.join(start_dir, item[0]))
+                    n_ahead += 1
+            rel_root, future = stack.pop()
+            n_ahead -= 1
+            dirs, files = future.result()
+            stack.extend([rel_dir, None] for rel_dir in children(rel_root, dirs))
+            yield rel_root, [d.name for d in dirs], [f.name for f in files]
+    finally:
+        for _, future in stack:
+            if future is not None:
+                future.cancel()
+        pool.shutdown(wait=True)
+
+
+def iter_files_in_dir(
+    in_dir,
+    ext=None,
+    return_absolute=True,
+    recursive=False,
+    re_filter=None,
+    case_sensitive_ext=False,
+    workers=1,
+    path_filter=None,
+    index=None,
+):
+    """
+    Lazily yield all files in the directory with the given extensions.
+
+    This is the generator form of get_all_files_in_dir, so files can be
+    processed while the rest of the directory tree is still being scanned.
+
+    Parameters
+    ----------
+    in_dir : str
+        The absolute path to the directory
+    ext : str, optional. Defaults to None.
+        The extension of files to get.
+    return_absolute : bool, optional. Defaults to True.
+        Whether to return the absolute filename or not.
+    recursive: bool, optional. Defaults to False.
+        Whether to recurse through directories.
+    re_filter: str, optional. Defaults to None
+        a regular expression used to filter the results
+    case_sensitive_ext: bool, optional. Defaults to False,
+        Whether to match the case of the file extension
+    workers: int, optional. Defaults to 1.
+        The number of threads used to scan directories, see walk_dir.
+    path_filter: PathFilter, optional. Defaults to None.
+        A filter applied to the path relative to in_dir.
+        If passed, ext, re_filter and case_sensitive_ext are ignored.
+    index: DirectoryIndex, optional. Defaults to None.
+        If passed, files are listed from this index instead of walking,
+        see skm_pyutils.index.DirectoryIndex.
+
+    Yields
+    ------
+    str
+        The filenames with the given parameters, in the same order
+        as get_all_files_in_dir.
+
+    Raises
+    ------
+    ValueError
+        If in_dir does not exist, raised on the first call to next.
+
+    """
+    if in_dir == "":
+        in_dir = "."
+    if not os.path.isdir(in_dir):
+        raise ValueError("Non existant directory " + str(in_dir))
+
+    if path_filter is None:
+        path_filter = PathFilter(
+            ext=ext, re_filter=re_filter, case_sensitive_ext=case_sensitive_ext
+        )
+
+    def convert_to_path(f):
+        return os.path.abspath(os.path.join(in_dir, f)) if return_absolute else f
+
+    if index is None:
+        walker = walk_dir(
+            in_dir,
+            recursive=recursive,
+            workers=workers,
+            dir_filter=path_filter.match_dir,
+        )
+    else:
+        walker = index.walk(
+            in_dir, recursive=recursive, dir_filter=path_filter.match_dir
+        )
+    for root, _, filenames in walker:
+        for filename in filenames:
+            filename = os.path.join(root, filename)
+            if path_filter.match_file(filename):
+                yield convert_to_path(filename)
+
+
 def get_all_files_in_dir(
     in_dir,
     ext=None,
@@ -57,6 +397,9 @@ def get_all_files_in_dir(
     verbose=False,
     re_filter=None,
     case_sensitive_ext=False,
+    workers=1,
+    path_filter=None,
+    index=None,
 ):
     """
     Get all files in the directory with the given extensions.
@@ -77,11 +420,25 @@ def get_all_files_in_dir(
         a regular expression used to filter the results
     case_sensitive_ext: bool, optional. Defaults to False,
         Whether to match the case of the file extension
+    workers: int, optional. Defaults to 1.
+        The number of threads used to scan directories, see walk_dir.
+    path_filter: PathFilter, optional. Defaults to None.
+        A filter applied to the path relative to in_dir.
+        If passed, ext, re_filter and case_sensitive_ext are ignored.
+    index: DirectoryIndex, optional. Defaults to None.
+        If passed, files are listed from this index instead of walking,
+        see skm_pyutils.index.DirectoryIndex.
 
     Returns
     -------
     List
         A list of filenames with the given parameters.
+        The files in each directory are sorted by name,
+        and subdirectories are visited depth first in sorted order.
+
+    See Also
+    --------
+    iter_files_in_dir : The lazy version of this function.
 
     """
     if in_dir == "":
@@ -89,61 +446,38 @@ def get_all_files_in_dir(
     if not os.path.isdir(in_dir):
         raise ValueError("Non existant directory " + str(in_dir))
 
-    def match_filter(f):
-        if re_filter is None:
-            return True
-        search_res = re.search(re_filter, f)
-        return search_res is not None
-
-    def ok_file(root_dir, f):
-        return (
-            has_ext(f, ext, case_sensitive_ext=case_sensitive_ext)
-            and os.path.isfile(os.path.join(root_dir, f))
-            and match_filter(f)
-        )
-
-    def convert_to_path(root_dir, f):
-        return os.path.abspath(os.path.join(root_dir, f)) if return_absolute else f
-
     if verbose:
         print("Adding following files from {}".format(in_dir))
 
-    if recursive:
-        onlyfiles = []
-        for root, _, filenames in os.walk(in_dir):
-            start_root = root[: len(in_dir)]
-
-            if len(root) == len(start_root):
-                end_root = ""
-            else:
-                if in_dir.endswith(os.sep):
-                    end_root = root[len(in_dir) :]
-                else:
-                    end_root = root[len(in_dir + os.sep) :]
-            for filename in filenames:
-                filename = os.path.join(end_root, filename)
-                if ok_file(start_root, filename):
-                    to_add = convert_to_path(start_root, filename)
-                    if verbose:
-                        print(to_add)
-                    onlyfiles.append(to_add)
-
-    else:
-        onlyfiles = [
-            convert_to_path(in_dir, f)
-            for f in sorted(os.listdir(in_dir))
-            if ok_file(in_dir, f)
-        ]
+    onlyfiles = []
+    for to_add in iter_files_in_dir(
+        in_dir,
+        ext=ext,
+        return_absolute=return_absolute,
+        recursive=recursive,
+        re_filter=re_filter,
+        case_sensitive_ext=case_sensitive_ext,
+        workers=workers,
+        path_filter=path_filter,
+        index=index,
+    ):
         if verbose:
-            for f in onlyfiles:
-                print(f)
+            print(to_add)
+        onlyfiles.append(to_add)
 
     if verbose:
         print()
     return onlyfiles
 
 
-def get_dirs_matching_regex(start_dir, re_filters=None, return_absolute=True):
+def get_dirs_matching_regex(
+    start_dir,
+    re_filters=None,
+    return_absolute=True,
+    path_filter=None,
+    workers=1,
+    index=None,
+):
     """
     Recursively get all directories from start_dir that match regex.
 
@@ -154,6 +488,17 @@ def get_dirs_matching_regex(start_dir, re_filters=None, return_absolute=True):
     re_filter : list of str, optional. Defaults to None.
         The list of regular expressions to match.
         Returns all directories if passed as None.
+    return_absolute : bool, optional. Defaults to True.
+        Whether to return the directory joined to start_dir.
+    path_filter : PathFilter, optional. Defaults to None.
+        Directories must match all regular expressions of the filter,
+        and pruned directories are skipped along with their subdirectories.
+        If passed, re_filters is ignored.
+    workers: int, optional. Defaults to 1.
+        The number of threads used to scan directories, see walk_dir.
+    index: DirectoryIndex, optional. Defaults to None.
+        If passed, directories are listed from this index instead of walking,
+        see skm_pyutils.index.DirectoryIndex.
 
     Returns
     -------
@@ -164,35 +509,34 @@ def get_dirs_matching_regex(start_dir, re_filters=None, return_absolute=True):
     if not os.path.isdir(start_dir):
         raise ValueError("Non existant directory " + str(start_dir))
 
-    def match_filter(f):
-        if re_filters is None:
-            return True
-        for re_filter in re_filters:
-            search_res = re.search(re_filter, f.replace(os.sep, "/"))
-            if search_res is None:
-                return False
-        return True
+    if path_filter is None:
+        path_filter = PathFilter(re_filter=re_filters)
 
     dirs = []
-    for root, _, _ in os.walk(start_dir):
-        start_root = root[: len(start_dir)]
-
-        if len(root) == len(start_root):
-            end_root = ""
-        else:
-            if start_dir.endswith(os.sep):
-                end_root = root[len(start_dir) :]
+    if index is None:
+        walker = walk_dir(start_dir, workers=workers, dir_filter=path_filter.match_dir)
+    else:
+        walker = index.walk(start_dir, dir_filter=path_filter.match_dir)
+    for end_root, _, _ in walker:
+        if path_filter.match_regex(end_root):
+            if return_absolute:
+                to_add = os.path.join(start_dir, end_root) if end_root else start_dir
             else:
-                end_root = root[len(start_dir + os.sep) :]
-
-        if match_filter(end_root):
-            to_add = root if return_absolute else end_root
+                to_add = end_root
             dirs.append(to_add)
     return dirs
 
 
 def get_base_dir_to_files(
-    filenames, start_dir, ext=None, re_filter=None, print_info=True
+    filenames,
+    start_dir,
+    ext=None,
+    re_filter=None,
+    print_info=True,
+    path_filter=None,
+    index=None,
+    stop_early=False,
+    match_on="name",
 ):
     """
     Get the base directory of a set of filenames.
@@ -201,8 +545,10 @@ def get_base_dir_to_files(
 
     Parameters
     ----------
-    filenames : list of str
+    filenames : list of str or dict
         The filenames to search for.
+        If match_on is "size" or "hash", a dictionary mapping each
+        filename to its expected size in bytes or its file_hash.
     start_dir : str
         Where to start the search.
     ext : str, optional
@@ -211,6 +557,21 @@ def get_base_dir_to_files(
         A regex to use to find files, by defaults None.
     print_info : bool, optional
         Whether to print info of the search, by default True.
+    path_filter : PathFilter, optional
+        A filter to use to find files, by default None.
+        If passed, ext and re_filter are ignored.
+    index : DirectoryIndex, optional
+        If passed, files are found from this index instead of walking,
+        by default None.
+    stop_early : bool, optional
+        Stop searching as soon as every filename has a match,
+        by default False. Multiple matches are then only reported
+        for files found before the search stopped.
+    match_on : str, optional
+        "name" to match on the filename only, "size" to also require
+        the file size to match, or "hash" to also require the file
+        contents to match, by default "name".
+        Sizes and hashes are only checked for files with a matching name.
 
     Returns
     -------
@@ -220,44 +581,122 @@ def get_base_dir_to_files(
         A set of files with no matches
     set
         A set of files with multiple matches
+
+    Raises
+    ------
+    ValueError
+        If match_on is not valid, or filenames is not a dictionary
+        when matching on size or hash.
+
     """
+    if match_on not in ("name", "size", "hash"):
+        raise ValueError(f"Unsupported match_on {match_on}")
+    if match_on != "name":
+        if not hasattr(filenames, "items"):
+            raise ValueError(
+                f"filenames must map each name to its {match_on} "
+                + f"when matching on {match_on}"
+            )
+        expected = dict(filenames.items())
+        if match_on == "hash":
+            expected = {k: v.lower() for k, v in expected.items()}
     filenames = list(filenames)
-    files_to_check = get_all_files_in_dir(
-        start_dir, ext=ext, re_filter=re_filter, recursive=True
+    order = {}
+    for i, name in enumerate(filenames):
+        order.setdefault(name, i)
+
+    def file_size(f):
+        info = index.file_info(f) if index is not None else None
+        return info[0] if info is not None else os.path.getsize(f)
+
+    files_to_check = iter_files_in_dir(
+        start_dir,
+        ext=ext,
+        re_filter=re_filter,
+        recursive=True,
+        path_filter=path_filter,
+        index=index,
     )
-    found_dict = OrderedDict()
-
+    found_dict = {}
+    remaining = set(order)
     for f in files_to_check:
         base = os.path.basename(f)
-        dirs = os.path.dirname(f)
-        if base in filenames:
-            if base not in found_dict.keys():
-                found_dict[base] = []
-            found_dict[base].append(dirs)
-
-    no_match = []
-    multi_match = []
-    found = list(found_dict.keys())
+        if base not in order:
+            continue
+        if match_on == "size" and file_size(f) != expected[base]:
+            continue
+        if match_on == "hash" and file_hash(f) != expected[base]:
+            continue
+        found_dict.setdefault(base, []).append(os.path.dirname(f))
+        if stop_early:
+            remaining.discard(base)
+            if len(remaining) == 0:
+                break
+
+    no_match = set()
+    multi_match = set()
     num_found = 0
     for v in filenames:
-        if v not in found:
-            no_match.append(v)
+        if v not in found_dict:
+            no_match.add(v)
         else:
             num_found += 1
             if len(found_dict[v]) > 1:
-                multi_match.append(v)
+                multi_match.add(v)
 
-    found_dict = OrderedDict(
-        sorted(found_dict.items(), key=lambda x: filenames.index(x[0]))
-    )
+    found_dict = OrderedDict(sorted(found_dict.items(), key=lambda x: order[x[0]]))
 
     if print_info:
         to_print = "Found {} files out of {}, {} have multiple matches".format(
-            num_found, len(filenames), len(set(multi_match))
+            num_found, len(filenames), len(multi_match)
         )
         print(to_print)
 
-    return found_dict, set(no_match), set(multi_match)
+    return found_dict, no_match, multi_match
+
+
+def _add_path_filter_args(parser):
+    """Add the command line arguments used to build a PathFilter."""
+    parser.add_argument(
+        "--extension",
+        "-e",
+        type=str,
+        action="append",
+        default=None,
+        help="Extension to look for, can be passed multiple times.",
+    )
+    parser.add_argument(
+        "--include",
+        type=str,
+        action="append",
+        default=None,
+        help="Glob pattern of files to include, can be passed multiple times.",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=str,
+        action="append",
+        default=None,
+        help="Glob pattern of files to exclude, can be passed multiple times.",
+    )
+    parser.add_argument(
+        "--prune",
+        type=str,
+        action="append",
+        default=None,
+        help="Glob pattern of directories to skip, can be passed multiple times.",
+    )
+
+
+def _path_filter_from_args(parsed, re_filter=None):
+    """Build a PathFilter from arguments added by _add_path_filter_args."""
+    return PathFilter(
+        ext=parsed.extension,
+        re_filter=re_filter,
+        include=parsed.include,
+        exclude=parsed.exclude,
+        prune=parsed.prune,
+    )
 
 
 def cli_entry():
@@ -273,29 +712,39 @@ def cli_entry():
         action="store_true",
         help="Whether to recurse into subdirectories.",
     )
+    _add_path_filter_args(parser)
     parser.add_argument(
-        "--extension", "-e", type=str, default=None, help="Extension to look for."
+        "--output", "-o", type=str, default=None, help="Name of output txt file."
     )
     parser.add_argument(
-        "--output", "-o", type=str, default=None, help="Name of output txt file."
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="Number of threads used to scan directories.",
     )
 
     parsed = parse_args(parser, verbose=False)
 
     if os.path.exists(parsed.directory):
-        files = get_all_files_in_dir(
-            parsed.directory,
-            ext=parsed.extension,
-            return_absolute=False,
-            recursive=parsed.recursive,
-        )
         output = (
             parsed.output
             if parsed.output is not None
             else os.path.join(parsed.directory, "current_contents.txt")
         )
+        files = iter_files_in_dir(
+            parsed.directory,
+            return_absolute=False,
+            recursive=parsed.recursive,
+            workers=parsed.workers,
+            path_filter=_path_filter_from_args(parsed),
+        )
+        output_abs = os.path.abspath(output)
         with open(output, "w") as f:
             for fname in files:
+                # The output file may be created inside the scanned tree
+                if os.path.abspath(os.path.join(parsed.directory, fname)) == output_abs:
+                    continue
                 f.write(f"{fname}\n")
     else:
         raise ValueError("Please pass a valid directory")
@@ -387,9 +836,7 @@ def cli_copy_files_in_dir():
         action="store_true",
         help="Whether to recurse into subdirectories.",
     )
-    parser.add_argument(
-        "--extension", "-e", type=str, default=None, help="Extension to look for."
-    )
+    _add_path_filter_args(parser)
     parser.add_argument(
         "--regular_expression",
         "-re",
@@ -406,16 +853,35 @@ def cli_copy_files_in_dir():
         action="store_true",
         help="Dummy run, only print files that would be copied.",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of files to copy at once.",
+    )
+    parser.add_argument(
+        "--link",
+        "-l",
+        action="store_true",
+        help="Hard link instead of copying files on the same file system.",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Copy files even if the output has the same size and mtime.",
+    )
 
     parsed = parse_args(parser, verbose=False)
 
     if os.path.exists(parsed.input_directory):
         files = get_all_files_in_dir(
             parsed.input_directory,
-            ext=parsed.extension,
             return_absolute=False,
             recursive=parsed.recursive,
-            re_filter=parsed.regular_expression,
+            path_filter=_path_filter_from_args(
+                parsed, re_filter=parsed.regular_expression
+            ),
         )
         if parsed.dummy:
             name = "move" if parsed.move else "copy"
@@ -425,13 +891,20 @@ def cli_copy_files_in_dir():
             return
 
         os.makedirs(parsed.output_directory, exist_ok=True)
-        for fname in files:
-            output_loc = os.path.join(parsed.output_directory, fname.replace(os.sep, "--"))
-            input_loc = os.path.join(parsed.input_directory, fname)
-            if parsed.move:
-                shutil.move(input_loc, output_loc)
-            else:
-                shutil.copy(input_loc, output_loc)
+        pairs = (
+            (
+                os.path.join(parsed.input_directory, fname),
+                os.path.join(parsed.output_directory, fname.replace(os.sep, "--")),
+            )
+            for fname in files
+        )
+        copy_files(
+            pairs,
+            jobs=parsed.jobs,
+            move=parsed.move,
+            link=parsed.link,
+            skip_up_to_date=not parsed.overwrite,
+        )
     else:
         raise ValueError("Please pass a valid directory")
 
@@ -7,7 +7,7 @@ from datetime import datetime
 from PyPDF2 import PdfMerger
 
 from skm_pyutils.config import parse_args
-from skm_pyutils.path import get_all_files_in_dir
+from skm_pyutils.path import iter_files_in_dir
 
 
 def pdf_cat(input_files, output_location):
@@ -16,7 +16,7 @@ def pdf_cat(input_files, output_location):
 
     Parameters
     ----------
-    input_files : list of str
+    input_files : iterable of str
         Paths to files to concatenate.
     output_location : str, optional
         The path to the output merged PDF location.
@@ -71,7 +71,7 @@ def merge_all_pdfs_in_dir(input_dir, out_name=None, recursive=False):
         out_name = f"pdf_merge_{whole_time}.pdf"
         out_name = os.path.abspath(os.path.join(input_dir, out_name))
 
-    pdf_files = get_all_files_in_dir(
+    pdf_files = iter_files_in_dir(
         input_dir, ext=".pdf", recursive=recursive, return_absolute=True
     )
 
@@ -1,10 +1,20 @@
 """Utilities for saving structures to disk."""
+import ast
 import csv
+import json
 import os
+import pickle
+import shutil
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, islice
 from typing import Union
 
 import numpy as np
 
+from skm_pyutils.compression import get_compression, open_file, strip_compression
 from skm_pyutils.log import log_exception
 from skm_pyutils.path import make_path_if_not_exists
 
@@ -22,119 +32,451 @@ def val_to_str(val):
     return out_str
 
 def arr_to_str(name, arr):
-    out_str = name
-    for val in arr:
-        str_val = val_to_str(val)
-        out_str = "{}, {}".format(out_str, str_val)
+    return ", ".join([str(name), *_values_to_str(arr)])
 
-    return out_str
 
+def _values_to_str(values):
+    """
+    Format the values of a list or array, as val_to_str does for each.
+
+    Whole numpy arrays of common types are converted with tolist
+    and formatted in one pass, instead of element by element.
 
-def save_mixed_dict_to_csv(in_dict, out_dir, out_name="results.csv", save=True):
+    """
+    if not isinstance(values, np.ndarray) or values.ndim != 1:
+        return map(val_to_str, values)
+    kind = values.dtype.kind
+    if values.dtype == np.float64:
+        return map("{:4f}".format, values.tolist())
+    elif kind in "iub":
+        # numpy integers and bools are not int, so val_to_str quotes them
+        return map('"{}"'.format, values.tolist())
+    elif kind == "U":
+        return (val.replace(" ", "_") for val in values.tolist())
+    return map(val_to_str, values)
+
+
+def _write_arr(write, name, values, batch_size=65536):
+    """Write name and the formatted values as one csv row, in batches."""
+    write(str(name))
+    values = iter(values)
+    while True:
+        batch = list(islice(values, batch_size))
+        if len(batch) == 0:
+            break
+        write(", ")
+        write(", ".join(batch))
+    write("\n")
+
+
+def save_mixed_dict_to_csv(
+    in_dict, out_dir, out_name="results.csv", save=True, return_str=True
+):
     """
     Save a dictionary with mixed value types to a csv.
 
     Currently dict, np.ndarray, and list are supported values.
     Each key in the dictionary is saved as a row in the output csv.
+    The csv is compressed if out_name ends with e.g. .gz or .zst,
+    see compression.open_file.
+    Rows are streamed to the file, so large arrays are never held
+    in memory as text unless return_str is True.
 
     Args:
         in_dict (dict): The dictionary to save to a csv.
         out_dir (str): The directory to save the csv to.
         out_name (str, optional): Defaults to "results.csv".
         save (bool, optional): Defaults to True.
+        return_str (bool, optional): Build and return the csv as a string.
+            Defaults to True.
 
     Returns:
-        The string representation of the data saved to csv.
+        The string representation of the data saved to csv,
+        or None if return_str is False.
 
     """
-    full_str = ""
+    parts = [] if return_str else None
+    f = None
     if save:
         out_loc = os.path.join(out_dir, out_name)
         make_path_if_not_exists(out_loc)
         print("Saving mixed dict data to {}".format(out_loc))
-        f = open(out_loc, "w")
+        f = open_file(out_loc, "w")
 
-    for key, val in in_dict.items():
-        if isinstance(val, dict):
-            if len(val) == 0:
-                out_str = "{},Empty".format(key)
-            else:
-                out_str = ""
+    def write(out_str):
+        if f is not None:
+            f.write(out_str)
+        if parts is not None:
+            parts.append(out_str)
+
+    try:
+        for key, val in in_dict.items():
+            if isinstance(val, dict):
+                if len(val) == 0:
+                    write("{},Empty\n".format(key))
                 for k2, val2 in val.items():
                     name = "{} -- {}".format(key, k2)
-                    out_str += arr_to_str(name, val2) + "\n"
-                out_str = out_str[:-1]
-        elif isinstance(val, np.ndarray):
-            out_str = arr_to_str(key, val.flatten())
-        elif isinstance(val, list):
-            out_str = arr_to_str(key, val)
+                    _write_arr(write, name, _values_to_str(val2))
+            elif isinstance(val, np.ndarray):
+                _write_arr(write, key, _values_to_str(val.ravel()))
+            elif isinstance(val, list):
+                _write_arr(write, key, _values_to_str(val))
+            else:
+                write("{},{}\n".format(key, val_to_str(val)))
+    finally:
+        if f is not None:
+            f.close()
+
+    return "".join(parts) if return_str else None
+
+
+# A mixed dict file is the magic bytes, the header length as 8 bytes,
+# a JSON header describing each value, then the raw array data,
+# with each array aligned so it can be memory mapped.
+_MIXED_MAGIC = b"SKMDICT1"
+_MIXED_ALIGN = 64
+
+
+def _align(n):
+    return -(-n // _MIXED_ALIGN) * _MIXED_ALIGN
+
+
+def _is_json_exact(val):
+    """Return True if val is unchanged by a round trip through JSON."""
+    if type(val) in (str, int, float, bool) or val is None:
+        return True
+    if type(val) is list:
+        return all(_is_json_exact(v) for v in val)
+    return False
+
+
+def _describe_value(val, blocks, offset):
+    """
+    Describe val in the header, adding any raw data to blocks
+    as (offset, data) pairs, where offset is from the start of the data.
+
+    Returns the header entry and the offset after the new blocks.
+
+    """
+    if isinstance(val, dict):
+        entries = []
+        for k, v in val.items():
+            entry, offset = _describe_value(v, blocks, offset)
+            entries.append([_check_key(k), entry])
+        return {"kind": "dict", "entries": entries}, offset
+    if isinstance(val, (np.ndarray, np.generic)) and val.dtype != object:
+        # Not ascontiguousarray, which turns 0-d arrays into 1-d
+        arr = np.asarray(val, order="C")
+        entry = {
+            "kind": "array",
+            "descr": repr(np.lib.format.dtype_to_descr(arr.dtype)),
+            "shape": list(arr.shape),
+            "scalar": isinstance(val, np.generic),
+            "offset": offset,
+            "nbytes": arr.nbytes,
+        }
+        blocks.append((offset, arr))
+        return entry, _align(offset + arr.nbytes)
+    if _is_json_exact(val):
+        text = json.dumps(val)
+        # Keep the header small, so opening the file stays fast
+        if len(text) <= 4096:
+            return {"kind": "json", "value": val}, offset
+    data = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+    blocks.append((offset, data))
+    entry = {"kind": "pickle", "offset": offset, "nbytes": len(data)}
+    return entry, _align(offset + len(data))
+
+
+def _check_key(key):
+    if type(key) not in (str, int, float, bool) and key is not None:
+        raise TypeError(f"Keys must be str, int, float, bool or None, not {key!r}")
+    return key
+
+
+def save_mixed_dict_to_file(in_dict, out_dir, out_name="results.mdict"):
+    """
+    Save a dictionary with mixed value types to a binary file.
+
+    A companion to save_mixed_dict_to_csv which keeps the values exactly.
+    numpy arrays are stored as raw data which can be memory mapped,
+    simple values (str, int, float, bool, None and lists of them)
+    are stored in a JSON header, and other values are pickled.
+    Nested dictionaries are kept.
+    Use load_mixed_dict to read the file back.
+
+    Parameters
+    ----------
+    in_dict : dict
+        The dictionary to save. Keys must be str, int, float, bool or None.
+    out_dir : str
+        The directory to save the file to.
+    out_name : str, optional
+        The name of the file, by default "results.mdict".
+
+    Returns
+    -------
+    str
+        The path to the saved file.
+
+    """
+    out_loc = os.path.join(out_dir, out_name)
+    make_path_if_not_exists(out_loc)
+    print("Saving mixed dict data to {}".format(out_loc))
+    blocks = []
+    header, _ = _describe_value(in_dict, blocks, 0)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(_MIXED_MAGIC) + 8 + len(header_bytes))
+
+    temp_loc = out_loc + ".tmp"
+    try:
+        with open(temp_loc, "wb") as f:
+            f.write(_MIXED_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for offset, block in blocks:
+                f.write(b"\0" * (data_start + offset - f.tell()))
+                if isinstance(block, np.ndarray):
+                    # A byte view works for every dtype, unlike memoryview
+                    f.write(block.reshape(-1).view(np.uint8))
+                else:
+                    f.write(block)
+        os.replace(temp_loc, out_loc)
+    finally:
+        if os.path.exists(temp_loc):
+            os.remove(temp_loc)
+    return out_loc
+
+
+class LazyMixedDict(Mapping):
+    """
+    A dictionary saved by save_mixed_dict_to_file, loaded key by key.
+
+    Only the header is read when the file is opened.
+    Each value is read from the file when it is first accessed,
+    so single keys of large files can be loaded quickly.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the file.
+    mmap : bool, optional
+        Memory map arrays instead of reading them, by default True.
+        Memory mapped arrays are read only, and are only loaded
+        into memory as they are used.
+
+    """
+
+    def __init__(self, filename, mmap=True, _entries=None, _data_start=None):
+        self.filename = filename
+        self.mmap = mmap
+        if _entries is None:
+            with open(filename, "rb") as f:
+                if f.read(len(_MIXED_MAGIC)) != _MIXED_MAGIC:
+                    raise ValueError(f"{filename} is not a mixed dict file")
+                header_len = int.from_bytes(f.read(8), "little")
+                header = json.loads(f.read(header_len).decode("utf-8"))
+            _entries = header["entries"]
+            _data_start = _align(len(_MIXED_MAGIC) + 8 + header_len)
+        self._data_start = _data_start
+        self._entries = {k: entry for k, entry in _entries}
+        self._cache = {}
+
+    def __repr__(self):
+        return f"LazyMixedDict({self.filename!r}, keys={list(self._entries)})"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = self._load(self._entries[key])
+        return self._cache[key]
+
+    def to_dict(self):
+        """Load every value, returning a plain dict."""
+        return {
+            k: v.to_dict() if isinstance(v, LazyMixedDict) else v
+            for k, v in self.items()
+        }
+
+    def _load(self, entry):
+        kind = entry["kind"]
+        if kind == "json":
+            return entry["value"]
+        elif kind == "dict":
+            return LazyMixedDict(
+                self.filename, self.mmap, entry["entries"], self._data_start
+            )
+        offset = self._data_start + entry["offset"]
+        if kind == "pickle":
+            with open(self.filename, "rb") as f:
+                f.seek(offset)
+                return pickle.loads(f.read(entry["nbytes"]))
+        # As in the .npy format, the dtype description is a python literal
+        dtype = np.lib.format.descr_to_dtype(ast.literal_eval(entry["descr"]))
+        shape = tuple(entry["shape"])
+        if entry["nbytes"] == 0:
+            arr = np.empty(shape, dtype=dtype)
+        elif self.mmap and not entry["scalar"]:
+            arr = np.memmap(
+                self.filename, dtype=dtype, mode="r", offset=offset, shape=shape
+            )
         else:
-            out_str = "{},{}".format(key, val_to_str(val))
-        full_str += out_str + "\n"
-        if save:
-            f.write(out_str + "\n")
-    
-    if save:
-        f.close()
+            with open(self.filename, "rb") as f:
+                f.seek(offset)
+                count = entry["nbytes"] // dtype.itemsize
+                arr = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+        return arr[()] if entry["scalar"] else arr
+
 
-    return full_str
+def load_mixed_dict(filename, mmap=True):
+    """
+    Load a dictionary saved by save_mixed_dict_to_file.
 
+    Values are loaded lazily, when each key is first accessed,
+    and nested dictionaries are also loaded lazily.
+    Call to_dict on the result to load everything.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the file.
+    mmap : bool, optional
+        Memory map arrays instead of reading them, by default True.
+
+    Returns
+    -------
+    LazyMixedDict
+        A read only mapping of the saved keys to values.
 
-def save_dicts_to_csv(filename, in_dicts, do_sort=True):
     """
-    Save a list of dictionaries to a csv, cols=vals, rows=dicts.
+    return LazyMixedDict(filename, mmap=mmap)
 
-    The headers are set as the maximal set of keys in in_dicts.
-    It is assumed that all other dicts will have a subset of these keys.
+
+class _Schema:
+    """
+    The csv columns of a stream of dicts, as used by save_dicts_to_csv.
+
+    The columns are the keys of the first dict with the most keys,
+    then any other keys in the order they are first seen,
+    sorted if there are other keys and do_sort is True.
+
+    """
+
+    def __init__(self, do_sort=True):
+        self.do_sort = do_sort
+        # Every key in the order it was first seen, as an ordered set
+        self.seen = {}
+        self.max_key = []
+
+    def add(self, in_dict):
+        """Add the keys of in_dict, returning True if any key is new."""
+        if len(in_dict) > len(self.max_key):
+            self.max_key = list(in_dict)
+        n_seen = len(self.seen)
+        for name in in_dict:
+            if name not in self.seen:
+                self.seen[name] = None
+        return len(self.seen) != n_seen
+
+    def columns(self):
+        max_set = set(self.max_key)
+        extra = [k for k in self.seen if k not in max_set]
+        columns = self.max_key + extra
+        if len(extra) > 0 and self.do_sort:
+            columns = sorted(columns)
+        return columns
+
+
+def save_dicts_to_csv(filename, in_dicts, do_sort=True, lookahead=1000):
+    """
+    Save an iterable of dictionaries to a csv, cols=vals, rows=dicts.
+
+    The headers are the keys of the dict with the most keys,
+    followed by any keys which are missing from it.
     Each entry in the dict is saved to a row of the csv, so it is assumed
     the values in the dict are mostly floats / ints / etc.
+    The csv is compressed if filename ends with e.g. .gz or .zst,
+    see compression.open_file.
+
+    The dicts are streamed to disk, so in_dicts can be a generator
+    of any length. The headers are found from the first lookahead dicts.
+    If later dicts change the headers, the rows written so far are
+    rewritten once at the end with the final headers, one row at a time.
 
     Parameters
     ----------
     filename : str
         The name of the csv file to save results to.
-    in_dicts : List
-        A list of dictionaries to save to csv.
+    in_dicts : iterable of dict
+        The dictionaries to save to csv.
     do_sort : bool, optional
         Whether to sort the keys after appending, by default True.
+    lookahead : int, optional
+        The number of dicts to read before writing, by default 1000.
 
     Returns
     -------
     None
 
     """
-    # first, find the dict with the most keys
-    if len(in_dicts) == 0:
+    in_dicts = iter(in_dicts)
+    first_dicts = list(islice(in_dicts, lookahead))
+    if len(first_dicts) == 0:
         return
-    max_key = list(in_dicts[0].keys())
-    for in_dict in in_dicts:
-        names = in_dict.keys()
-        if len(names) > len(max_key):
-            max_key = list(names)
-
-    # Then append other keys if still missing keys
-    did_append = False
-    for in_dict in in_dicts:
-        names = in_dict.keys()
-        for name in names:
-            if name not in max_key:
-                did_append = True
-                max_key.append(name)
-    if did_append and do_sort:
-        max_key = sorted(max_key)
-    max_key_friendly = [k.replace(" ", "_") for k in max_key]
 
+    schema = _Schema(do_sort)
+    for in_dict in first_dicts:
+        schema.add(in_dict)
+    header = schema.columns()
+
+    dirname, basename = os.path.split(filename)
+    temp_name = os.path.join(dirname, ".{}.tmp{}".format(*os.path.splitext(basename)))
     try:
         print("Saving summary data to {}".format(filename))
         make_path_if_not_exists(filename)
-        with open(filename, "w", newline="") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=max_key)
-            writer.writerow(dict(zip(max_key, max_key_friendly)))
-            for in_dict in in_dicts:
-                writer.writerow(in_dict)
+        # Columns found after the header are added to the end of each row
+        written = list(header)
+        written_set = set(written)
+        with open_file(temp_name, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow([k.replace(" ", "_") for k in header])
+            for in_dict in chain(first_dicts, in_dicts):
+                if schema.add(in_dict):
+                    for k in in_dict:
+                        if k not in written_set:
+                            written.append(k)
+                            written_set.add(k)
+                writer.writerow([in_dict.get(k, "") for k in written])
+        del first_dicts
+
+        columns = schema.columns()
+        if columns == header:
+            os.replace(temp_name, filename)
+            return
+        position_of = {k: i for i, k in enumerate(written)}
+        positions = [position_of[k] for k in columns]
+        with open_file(temp_name, "r", newline="") as old_file, open_file(
+            filename, "w", newline=""
+        ) as csvfile:
+            reader = csv.reader(old_file)
+            writer = csv.writer(csvfile)
+            next(reader)
+            writer.writerow([k.replace(" ", "_") for k in columns])
+            n_written = len(written)
+            for row in reader:
+                row.extend([""] * (n_written - len(row)))
+                writer.writerow([row[i] for i in positions])
 
     except Exception as e:
         log_exception(e, "When {} saving to csv".format(filename))
+    finally:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
 
 
 def data_dict_from_attr_list(
@@ -186,31 +528,452 @@ def data_dict_from_attr_list(
     ValueError
         attr_list and friendly_names are not the same size.
 
+    See Also
+    --------
+    AttrExtractor, to get the same attributes from many items.
+
     """
-    if friendly_names is not None and len(friendly_names) != len(attr_list):
-        raise ValueError("friendly_names and attr_list must be the same length")
+    return AttrExtractor(attr_list, friendly_names)(input_item)
 
-    data_out = {}
-    for i, attr_tuple in enumerate(attr_list):
-        item = input_item
-        for a in attr_tuple:
-            if a is None:
-                break
-            item = (
-                getattr(item, a) if isinstance(a, str) and hasattr(item, a) else item[a]
-            )
-            if callable(item):
-                item = item()
-        if isinstance(item, dict):
-            for key, value in item.items():
-                data_out[key] = value
-        else:
+
+class AttrExtractor:
+    """
+    A compiled data_dict_from_attr_list, for many items.
+
+    The attribute tuples are parsed once into a plan of access steps
+    and output keys, which is then run on each item, so building a table
+    from many objects does not re-interpret attr_list per item.
+    The plan is plain data, so an extractor can be sent to processes.
+
+    Parameters
+    ----------
+    attr_list : list
+        The list of attributes to retrieve, see data_dict_from_attr_list.
+    friendly_names : list of str, optional
+        What to name each retrieved attribute, (default None).
+        Must be the same size as attr_list or None.
+
+    Raises
+    ------
+    ValueError
+        attr_list and friendly_names are not the same size.
+
+    Example
+    -------
+    extractor = AttrExtractor([("data", "running_speed"), ("results", "addition")])
+    row = extractor(recording)
+    df = extractor.to_df(recordings, workers=8)
+
+    """
+
+    def __init__(self, attr_list, friendly_names=None):
+        if friendly_names is not None and len(friendly_names) != len(attr_list):
+            raise ValueError("friendly_names and attr_list must be the same length")
+        self.attr_list = attr_list
+        self.friendly_names = friendly_names
+        self._plan = []
+        for i, attr_tuple in enumerate(attr_list):
+            steps = []
+            for a in attr_tuple:
+                if a is None:
+                    break
+                steps.append((isinstance(a, str), a))
             non_none_attrs = [x for x in attr_tuple if x is not None]
-            if friendly_names is None:
+            key = None if friendly_names is None else friendly_names[i]
+            if key is None and all(isinstance(x, str) for x in non_none_attrs):
                 key = "_".join(non_none_attrs)
+            self._plan.append((tuple(steps), key, non_none_attrs))
+
+    def __repr__(self):
+        return f"AttrExtractor({self.attr_list!r})"
+
+    def __call__(self, input_item):
+        """Get the attributes of one item, as data_dict_from_attr_list."""
+        data_out = {}
+        for steps, key, non_none_attrs in self._plan:
+            item = input_item
+            for is_str, a in steps:
+                if is_str:
+                    try:
+                        item = getattr(item, a)
+                    except AttributeError:
+                        item = item[a]
+                else:
+                    item = item[a]
+                if callable(item):
+                    item = item()
+            if isinstance(item, dict):
+                data_out.update(item)
+            elif key is None:
+                # Raises the same error as joining non string attributes
+                data_out["_".join(non_none_attrs)] = item
+            else:
+                data_out[key] = item
+        return data_out
+
+    def extract_many(self, items, workers=1, use_processes=False, chunksize=64):
+        """
+        Get the attributes of many items.
+
+        Parameters
+        ----------
+        items : iterable
+            The items to get attributes from.
+        workers : int, optional
+            The number of threads or processes to use, by default 1.
+            Useful when the attributes are expensive callables.
+        use_processes : bool, optional
+            Use processes instead of threads, by default False.
+            The items and attributes must then be picklable.
+        chunksize : int, optional
+            The number of items sent to each process at a time,
+            by default 64.
+
+        Returns
+        -------
+        list of dict
+            The attributes of each item, in order.
+
+        """
+        if workers is None or workers <= 1:
+            return [self(item) for item in items]
+        if use_processes:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(self, items, chunksize=chunksize))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(self, items))
+
+    def to_columns(self, items, **kwargs):
+        """
+        Get the attributes of many items as columns.
+
+        Keys missing from some items are None in those rows.
+        Takes the same keyword arguments as extract_many.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            The values of each key, with one entry per item.
+
+        """
+        rows = self.extract_many(items, **kwargs)
+        names = {}
+        for row in rows:
+            for name in row:
+                names[name] = None
+        columns = {}
+        for name in names:
+            values = [row.get(name) for row in rows]
+            try:
+                columns[name] = np.asarray(values)
+            except ValueError:
+                # e.g. lists of different lengths
+                column = np.empty(len(values), dtype=object)
+                column[:] = values
+                columns[name] = column
+        return columns
+
+    def to_df(self, items, **kwargs):
+        """
+        Get the attributes of many items as a pandas.DataFrame.
+
+        Each item is a row and each key a column.
+        Takes the same keyword arguments as extract_many.
+
+        """
+        import pandas as pd
+
+        rows = self.extract_many(items, **kwargs)
+        return pd.DataFrame.from_records(rows)
+
+
+class ResultSink:
+    """
+    Save rows of results to disk as they are produced, in batches.
+
+    Rows are buffered in memory and appended to the file in the background
+    once batch_size rows are buffered, or when a row is added more than
+    flush_interval seconds after the last flush.
+    So a long run only holds one batch in memory,
+    and a crash loses at most the rows which were not yet flushed.
+
+    A .csv or .psv file (optionally compressed, e.g. .csv.gz) is appended to
+    directly. If a crash cut off a compressed file, it is rewritten with
+    its complete rows when resumed. A .parquet name is a directory of
+    parquet files, one per batch, which pandas.read_parquet and df_from_file
+    read as one table.
+    Every parquet batch must have the same column types as the first.
+
+    By default an existing file is resumed: new rows are appended to it,
+    and n_resumed gives the number of rows already on disk,
+    so the run can skip the work which was already done.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the file to save to.
+    batch_size : int, optional
+        The number of rows to buffer before writing, by default 1000.
+    flush_interval : float, optional
+        The maximum number of seconds to buffer rows for, by default 60.
+        This is checked when rows are added.
+    columns : list of str, optional
+        The columns to save, by default the keys of the first row.
+        Missing values are left empty, and unknown keys raise a ValueError.
+    resume : bool, optional
+        Append to an existing file, by default True.
+        Otherwise an existing file is replaced.
+
+    Example
+    -------
+    with ResultSink("results.csv") as sink:
+        for i in range(sink.n_resumed, len(params)):
+            sink.add(run_simulation(params[i]))
+
+    """
+
+    csv_extensions = (".csv", ".psv")
+
+    def __init__(
+        self,
+        filename,
+        batch_size=1000,
+        flush_interval=60.0,
+        columns=None,
+        resume=True,
+    ):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.columns = None if columns is None else list(columns)
+        self.ext = os.path.splitext(strip_compression(filename))[1]
+        if self.ext not in self.csv_extensions + (".parquet",):
+            raise ValueError(f"Unsupported file extension {self.ext}")
+        if self.ext == ".parquet" and get_compression(filename) is not None:
+            raise ValueError("Compressed parquet names are not supported")
+
+        self.n_resumed = 0
+        self._n_parts = 0
+        self._schema = None
+        if os.path.exists(filename):
+            if resume:
+                self._resume()
+            elif os.path.isdir(filename):
+                shutil.rmtree(filename)
             else:
-                key = friendly_names[i]
-                if key is None:
-                    key = "_".join(non_none_attrs)
-            data_out[key] = item
-    return data_out
+                os.remove(filename)
+        make_path_if_not_exists(filename)
+        self.n_written = self.n_resumed
+
+        self._column_set = None
+        self._rows = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """The number of rows on disk and buffered, including resumed rows."""
+        return self.n_written + len(self._rows)
+
+    def add(self, row):
+        """Add a row, a dict from column names to values."""
+        if self._column_set is None:
+            if self.columns is None:
+                self.columns = list(row)
+            self._column_set = set(self.columns)
+        unknown = [k for k in row if k not in self._column_set]
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown columns {unknown}, expected {self.columns}")
+        with self._lock:
+            self._rows.append(row)
+            full = len(self._rows) >= self.batch_size
+        if full or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def extend(self, rows):
+        """Add each row of an iterable of rows."""
+        for row in rows:
+            self.add(row)
+
+    def flush(self, wait=False):
+        """
+        Write the buffered rows in the background.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Wait until every row is on disk, by default False.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._last_flush = time.monotonic()
+            if len(rows) > 0:
+                self._pending.append(self._pool.submit(self._write, rows))
+        self._check_pending(wait)
+
+    def close(self):
+        """Write any buffered rows and wait for every write to finish."""
+        try:
+            self.flush(wait=True)
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def read(self):
+        """Flush, then read every saved row as a pandas DataFrame."""
+        from skm_pyutils.table import df_from_file
+
+        self.flush(wait=True)
+        return df_from_file(self.filename, cache=False)
+
+    def _check_pending(self, wait):
+        """Raise the error of any failed write."""
+        pending = []
+        for future in self._pending:
+            if wait or future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self._pending = pending
+
+    def _write(self, rows):
+        if self.ext == ".parquet":
+            self._write_parquet(rows)
+        else:
+            self._write_csv(rows)
+        self.n_written += len(rows)
+
+    def _write_csv(self, rows):
+        new_file = not os.path.exists(self.filename)
+        delimiter = "|" if self.ext == ".psv" else ","
+        with open_file(self.filename, "a", newline="") as f:
+            writer = csv.writer(f, delimiter=delimiter)
+            if new_file:
+                writer.writerow(self.columns)
+            writer.writerows([row.get(k, "") for k in self.columns] for row in rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_parquet(self, rows):
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        df = pd.DataFrame.from_records(rows, columns=self.columns)
+        # Every part has the types of the first, so they read as one table
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        if self._schema is None:
+            self._schema = table.schema
+        os.makedirs(self.filename, exist_ok=True)
+        part = os.path.join(self.filename, f"part-{self._n_parts:05d}.parquet")
+        # Written to a hidden name first, which parquet readers skip
+        temp_part = os.path.join(self.filename, f".part-{self._n_parts:05d}.tmp")
+        pq.write_table(table, temp_part)
+        os.replace(temp_part, part)
+        self._n_parts += 1
+
+    def _resume(self):
+        """Find the columns and number of rows already on disk."""
+        if self.ext == ".parquet":
+            import pyarrow.parquet as pq
+
+            names = sorted(
+                name
+                for name in os.listdir(self.filename)
+                if name.startswith("part-") and name.endswith(".parquet")
+            )
+            if len(names) == 0:
+                return
+            parts = [os.path.join(self.filename, name) for name in names]
+            self._schema = pq.read_schema(parts[0])
+            self.n_resumed = sum(pq.read_metadata(p).num_rows for p in parts)
+            self._n_parts = int(names[-1][len("part-") : -len(".parquet")]) + 1
+            existing = self._schema.names
+        else:
+            if get_compression(self.filename) is None:
+                _truncate_partial_line(self.filename)
+            delimiter = "|" if self.ext == ".psv" else ","
+            with open_file(self.filename, "r", newline="") as f:
+                lines = _CompleteLines(f)
+                reader = csv.reader(lines, delimiter=delimiter)
+                existing = next(reader, None)
+                self.n_resumed = sum(1 for _ in reader)
+            if existing is None:
+                os.remove(self.filename)
+                return
+            if lines.cut_off:
+                _rewrite_complete_lines(self.filename)
+        if self.columns is not None and self.columns != existing:
+            raise ValueError(
+                f"Columns {self.columns} do not match "
+                + f"{existing} in {self.filename}"
+            )
+        self.columns = existing
+
+
+class _CompleteLines:
+    """
+    Iterate over the complete lines of a text file.
+
+    Stops at a last line without a newline, or where a compressed file
+    was cut off, e.g. by a crash during a write, and sets cut_off.
+
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.cut_off = False
+
+    def __iter__(self):
+        try:
+            for line in self.f:
+                if not line.endswith("\n"):
+                    self.cut_off = True
+                    return
+                yield line
+        except Exception:
+            # Each codec raises its own error for a truncated stream
+            self.cut_off = True
+
+
+def _rewrite_complete_lines(filename):
+    """Rewrite a compressed text file which was cut off, keeping whole lines."""
+    dirname, basename = os.path.split(filename)
+    # The temporary name keeps the suffix, so it has the same compression
+    temp_name = os.path.join(dirname, f".{basename}")
+    try:
+        with open_file(filename, "r", newline="") as f, open_file(
+            temp_name, "w", newline=""
+        ) as out:
+            out.writelines(_CompleteLines(f))
+        os.replace(temp_name, filename)
+    finally:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+
+
+def _truncate_partial_line(filename):
+    """Remove a last line which was cut off, e.g. by a crash during a write."""
+    with open(filename, "rb+") as f:
+        size = end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - 65536, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
@@ -32,13 +32,9 @@ def plot_dists(x, y, ax=None, **fmt_kwargs):
     trim = fmt_kwargs.get("trim", True)
     offset = fmt_kwargs.get("offset", None)
 
-    df_list = []
-    for val in x:
-        df_list.append([val, group1_name])
-    for val in y:
-        df_list.append([val, group2_name])
-
-    df = list_to_df(df_list, headers=[vname, "group"])
+    values = np.concatenate([np.ravel(x), np.ravel(y)])
+    groups = np.repeat([group1_name, group2_name], [np.size(x), np.size(y)])
+    df = list_to_df([values, groups], headers=[vname, "group"], transpose=True)
     sns.kdeplot(data=df, x=vname, hue="group", multiple="stack", ax=ax)
 
     ax.set_xlabel(vname)
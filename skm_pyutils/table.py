@@ -1,9 +1,24 @@
 """Utilities for pandas dataframes."""
+import hashlib
+import importlib.util
+import operator
 import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 
+from skm_pyutils.compression import (
+    get_compression,
+    open_file,
+    path_or_open_file,
+    strip_compression,
+)
+
 
 def list_to_df(in_list, headers=None, transpose=False):
     """
@@ -22,6 +37,9 @@ def list_to_df(in_list, headers=None, transpose=False):
         ...
         (col N) [1_N, 2_N, ..., M_N]
     ]
+    and each column keeps its own type, so columns of numbers
+    or numpy arrays are not converted through objects.
+    A 2D numpy array is converted directly, keeping its type.
 
     Parameters
     ----------
@@ -43,7 +61,15 @@ def list_to_df(in_list, headers=None, transpose=False):
         else:
             headers = ["V{}".format(i) for i in range(len(in_list))]
 
+    if isinstance(in_list, np.ndarray) and in_list.ndim == 2:
+        # A transposed view, so the values are not copied to objects
+        return pd.DataFrame(in_list.T if transpose else in_list, columns=headers)
+
     if transpose:
+        lengths = {len(col) for col in in_list}
+        if len(lengths) <= 1 and len(set(headers)) == len(in_list) == len(headers):
+            # Each column keeps its own type, without an object transpose
+            return pd.DataFrame(dict(zip(headers, in_list)))
         df = pd.DataFrame(in_list).T
         df.columns = headers
     else:
@@ -51,37 +77,708 @@ def list_to_df(in_list, headers=None, transpose=False):
     return df
 
 
-def df_from_file(filename):
+# The filter ops follow pandas for NaN: NaN never equals anything,
+# so ("x", "!=", np.nan) keeps every row and ("x", "==", np.nan) none,
+# while "in" and "not in" treat NaN as a value, as Series.isin does.
+# TableFilter indexes must give the same rows.
+_FILTER_OPS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda col, val: col.isin(val),
+    "not in": lambda col, val: ~col.isin(val),
+}
+
+
+def _filters_to_mask(df, filters):
+    """Evaluate filters like [("col", ">", 1)] on a dataframe as a mask."""
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        if op not in _FILTER_OPS:
+            raise ValueError(f"Unsupported filter operation {op}")
+        mask &= np.asarray(_FILTER_OPS[op](df[column], value), dtype=bool)
+    return mask
+
+
+def _filters_to_where(filters):
+    """
+    Convert filters like [("col", ">", 1)] to a HDF5 where query.
+
+    Returns None if a column name can't be used in a query,
+    e.g. if it has a space, so the filters must be applied after reading.
+
+    """
+    terms = []
+    for column, op, value in filters:
+        if not isinstance(column, str) or not column.isidentifier():
+            return None
+        if op in ("in", "not in"):
+            op = "=" if op == "in" else "!="
+            value = [_to_python(v) for v in value]
+        else:
+            value = _to_python(value)
+        terms.append(f"{column} {op} {value!r}")
+    return " & ".join(terms)
+
+
+def _to_python(value):
+    """Convert numpy values, whose repr is e.g. np.int64(5), to python values."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return value
+
+
+def downcast_df(df, max_category_ratio=0.5):
+    """
+    Convert the columns of a dataframe to the smallest types that hold them.
+
+    Integers are converted to the smallest signed integer type holding
+    their range, floats to float32 only if no value changes, and text
+    columns with few unique values to categoricals.
+    Unsigned types are not used, as subtracting them wraps around,
+    but arithmetic can still overflow the smaller types.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The dataframe to convert.
+    max_category_ratio : float, optional
+        Text columns with at most this fraction of unique values
+        are made categorical, by default 0.5.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A new dataframe with the converted columns.
+
+    """
+    df = df.copy(deep=False)
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        if pd.api.types.is_bool_dtype(col):
+            continue
+        elif pd.api.types.is_integer_dtype(col):
+            df.isetitem(i, pd.to_numeric(col, downcast="integer"))
+        elif pd.api.types.is_float_dtype(col) and col.dtype != np.float32:
+            values = col.to_numpy(dtype=np.float64)
+            with np.errstate(over="ignore"):
+                small = values.astype(np.float32)
+            if np.array_equal(small, values, equal_nan=True):
+                df.isetitem(i, pd.Series(small, index=col.index, name=col.name))
+        elif pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col):
+            if len(col) > 0 and col.nunique() <= max_category_ratio * len(col):
+                df.isetitem(i, col.astype("category"))
+    return df
+
+
+def _sample_csv_dtypes(filename, read_kwargs, sample_rows=10000):
+    """Find the text columns to parse as categoricals from the first rows."""
+    with path_or_open_file(filename) as source:
+        sample = pd.read_csv(source, nrows=sample_rows, **read_kwargs)
+    small = downcast_df(sample.select_dtypes(exclude="number"))
+    return {
+        name: "category"
+        for name, dtype in small.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    }
+
+
+# Files smaller than this are parsed with the C engine when engine="auto"
+AUTO_ENGINE_MIN_BYTES = 8 * 1024 * 1024
+
+# read_csv options that the pyarrow engine does not support
+_PYARROW_UNSUPPORTED = {
+    "chunksize",
+    "comment",
+    "converters",
+    "dayfirst",
+    "dialect",
+    "float_precision",
+    "iterator",
+    "lineterminator",
+    "low_memory",
+    "memory_map",
+    "nrows",
+    "quoting",
+    "skipfooter",
+    "skipinitialspace",
+    "thousands",
+}
+
+
+def _choose_csv_engine(filename, engine, read_kwargs):
+    """
+    Pick the read_csv engine for df_from_file.
+
+    With engine "auto", pyarrow is used for large files where most
+    columns are numeric, as its multithreaded parser is much faster
+    on those, and the C engine otherwise.
+    pyarrow falls back to the C engine if it is not installed,
+    or if read_kwargs has options it does not support.
+
+    """
+    if engine not in ("auto", "c", "pyarrow", "python"):
+        raise ValueError(f"Unsupported engine {engine}")
+    if engine in ("c", "python"):
+        return engine
+    if importlib.util.find_spec("pyarrow") is None:
+        return "c"
+    if _PYARROW_UNSUPPORTED.intersection(read_kwargs):
+        return "c"
+    if engine == "pyarrow":
+        return engine
+    if os.path.getsize(filename) < AUTO_ENGINE_MIN_BYTES:
+        return "c"
+    with path_or_open_file(filename) as source:
+        sample = pd.read_csv(source, nrows=100, **read_kwargs)
+    n_numeric = sample.select_dtypes(include="number").shape[1]
+    return "pyarrow" if n_numeric >= sample.shape[1] / 2 else "c"
+
+
+def _read_csv(filename, engine, **kwargs):
+    """Read a csv file with the engine picked by _choose_csv_engine."""
+    chosen = _choose_csv_engine(filename, engine, kwargs)
+    if chosen != "pyarrow" or engine == "pyarrow":
+        with path_or_open_file(filename) as source:
+            return pd.read_csv(source, engine=chosen, **kwargs)
+    try:
+        with path_or_open_file(filename) as source:
+            return pd.read_csv(source, engine=chosen, **kwargs)
+    except ValueError:
+        # pyarrow is stricter, e.g. about rows with extra fields
+        with path_or_open_file(filename) as source:
+            return pd.read_csv(source, engine="c", **kwargs)
+
+
+def _read_feather(filename, columns, filters, memory_map):
+    """
+    Open an Arrow IPC file for reading.
+
+    Returns a pyarrow.Table with columns and filters applied if memory_map,
+    otherwise a pyarrow.dataset.Dataset and the filter expression to scan it.
+
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    expression = pq.filters_to_expression(filters) if filters else None
+    if not memory_map:
+        import pyarrow.dataset as ds
+
+        return ds.dataset(filename, format="feather"), expression
+    # Arrow buffers point into the mapped file, so only the pages
+    # that are used need to be resident in memory
+    table = pa.ipc.open_file(pa.memory_map(filename, "r")).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    if expression is not None:
+        table = table.filter(expression)
+    return table, None
+
+
+def _iter_df_chunks(
+    filename, ext, columns, filters, chunksize, downcast, memory_map, kwargs
+):
+    """Yield a file as dataframes of at most chunksize rows."""
+    pushed_down = False
+    if ext in (".csv", ".psv"):
+        if ext == ".psv":
+            kwargs["delimiter"] = "|"
+
+        def read_chunks():
+            with path_or_open_file(filename) as source:
+                yield from pd.read_csv(
+                    source,
+                    usecols=columns,
+                    chunksize=chunksize,
+                    memory_map=memory_map,
+                    **kwargs,
+                )
+
+        chunks = read_chunks()
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(filename, memory_map=memory_map).iter_batches(
+            batch_size=chunksize, columns=columns
+        )
+        chunks = (batch.to_pandas(**kwargs) for batch in batches)
+    elif ext in (".feather", ".arrow"):
+        source, expression = _read_feather(filename, columns, filters, memory_map)
+        if memory_map:
+            batches = source.to_batches(max_chunksize=chunksize)
+        else:
+            batches = source.to_batches(
+                columns=columns, filter=expression, batch_size=chunksize
+            )
+        chunks = (batch.to_pandas(**kwargs) for batch in batches if batch.num_rows)
+        pushed_down = True
+    elif ext in (".h5", ".hdf5"):
+        key = kwargs.pop("key", "df")
+        where = _filters_to_where(filters) if filters else None
+        chunks = pd.read_hdf(
+            filename,
+            key=key,
+            columns=columns,
+            where=where,
+            chunksize=chunksize,
+            **kwargs,
+        )
+        pushed_down = where is not None
+    elif ext == ".xlsx":
+        # Excel files can't be parsed in parts, so only the output is chunked
+        df = pd.read_excel(filename, usecols=columns, **kwargs)
+        chunks = (df.iloc[i : i + chunksize] for i in range(0, len(df), chunksize))
+    else:
+        raise ValueError(f"Unsupported file extension {ext}")
+
+    for chunk in chunks:
+        if filters and not pushed_down:
+            chunk = chunk[_filters_to_mask(chunk, filters)]
+        if downcast:
+            chunk = downcast_df(chunk)
+        yield chunk
+
+
+class TableCache:
+    """
+    An on-disk cache of parsed tables, used by df_from_file.
+
+    Tables are pickled under location, keyed by the path, size and
+    modification time of the source file and the options used to read it,
+    so a changed file is parsed again.
+    Once the cache holds more than max_bytes, the least recently used
+    tables are removed. Several processes can share a cache,
+    and failing to write to it never fails a read.
+
+    Parameters
+    ----------
+    location : str, optional
+        The cache directory, by default home/.skm_python/table_cache.
+    max_bytes : int, optional
+        The maximum total size of the cache, by default 2 GB.
+    min_bytes : int, optional
+        Files smaller than this are not cached, by default 256 KB,
+        as they are quick to parse anyway.
+
+    """
+
+    extensions = (".csv", ".psv", ".xlsx")
+
+    def __init__(self, location=None, max_bytes=2 * 1024**3, min_bytes=256 * 1024):
+        if location is None:
+            location = os.path.join(
+                os.path.expanduser("~"), ".skm_python", "table_cache"
+            )
+        self.location = location
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
+        os.makedirs(self.location, exist_ok=True)
+
+    def __repr__(self):
+        return f"TableCache({self.location!r}, max_bytes={self.max_bytes})"
+
+    def key(self, filename, **options):
+        """Return the cache key for reading filename with options."""
+        st = os.stat(filename)
+        parts = (
+            os.path.abspath(filename),
+            st.st_size,
+            st.st_mtime_ns,
+            sorted(options.items()),
+        )
+        return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        """Return the cached dataframe for key, or None if not cached."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            df = pd.read_pickle(path)
+        except Exception:
+            # e.g. a truncated file, or a pickle from another pandas version
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # The modification time marks when the entry was last used
+        try:
+            os.utime(path)
+        except OSError:
+            # Another process evicted the entry after it was read
+            pass
+        return df
+
+    def put(self, key, df):
+        """
+        Store df under key, then evict old entries if needed.
+
+        Tables larger than max_bytes are not stored, and errors writing
+        the cache, e.g. a full disk, are ignored.
+
+        """
+        if df.memory_usage(index=True).sum() > self.max_bytes:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            df.to_pickle(temp_path)
+            if os.path.getsize(temp_path) > self.max_bytes:
+                return
+            os.replace(temp_path, path)
+            self.evict()
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Remove the least recently used entries until under max_bytes."""
+        entries = []
+        with os.scandir(self.location) as it:
+            for entry in it:
+                if entry.name.endswith(".pkl"):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        # Removed by another process during the scan
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        self.evict()
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.location, key + ".pkl")
+
+
+_default_table_cache = None
+
+
+def _resolve_cache(cache):
+    """Return the TableCache to use for a cache argument, or None."""
+    global _default_table_cache
+    if cache is False or cache is None:
+        return None
+    if cache is not True:
+        return cache
+    if _default_table_cache is None:
+        try:
+            _default_table_cache = TableCache()
+        except OSError:
+            return None
+    return _default_table_cache
+
+
+def df_from_file(
+    filename,
+    columns=None,
+    filters=None,
+    chunksize=None,
+    downcast=False,
+    memory_map=False,
+    engine="c",
+    cache=True,
+    **kwargs,
+):
     """
     Read a pandas.DataFrame from filename.
 
+    Supported formats are .csv, .psv, .xlsx, .parquet, .feather or .arrow
+    (Arrow IPC), and .h5 or .hdf5. The columnar formats need pyarrow,
+    or pytables for HDF5.
+    Compressed .csv and .psv files, such as .csv.gz or .csv.zst,
+    are decompressed as they are parsed, see compression.open_file.
+
     Parameters
     ----------
     filename : str
         The path to the file to read
+    columns : list of str, optional
+        Only read these columns, by default all columns.
+        For the columnar formats, the other columns are never read.
+    filters : list of tuple, optional
+        Only keep rows where all the filters hold, by default None.
+        Each filter is (column, op, value), op is one of
+        "==", "!=", "<", "<=", ">", ">=", "in" or "not in".
+        Parquet and Arrow files skip row groups and batches which can't
+        match, HDF5 files (written by df_to_file) use a where query
+        if every filtered column name is a valid identifier,
+        and other formats filter the rows after reading.
+    chunksize : int, optional
+        If given, return an iterator of dataframes with at most this
+        many rows, instead of reading the whole file at once.
+        Excel files are still parsed in one go.
+    downcast : bool, optional
+        Store the data in the smallest types that hold it, see downcast_df,
+        by default False. For text files the first rows are sampled
+        to parse text columns straight to categoricals.
+        When reading in chunks, each chunk is converted separately,
+        so the types of different chunks may not match.
+    memory_map : bool, optional
+        Memory map the file instead of reading it, by default False.
+        For Arrow files this means only the parts of the file that are
+        used are loaded into memory.
+    engine : str, optional
+        The parser for .csv and .psv files, "c", "pyarrow" or "auto",
+        by default "c". "pyarrow" is multithreaded and several times
+        faster on wide numeric files, "auto" uses it for such files over
+        AUTO_ENGINE_MIN_BYTES. Falls back to "c" if pyarrow is not
+        installed, for options it does not support, and when reading
+        in chunks or memory mapping. pyarrow infers some types differently,
+        e.g. ISO dates are parsed to datetime.date rather than kept as
+        strings, and floats are always correctly rounded, so can differ
+        from the C engine in the last digit. So "pyarrow" and "auto"
+        are opt in, and with "auto" the result can depend on file size.
+    cache : bool or TableCache, optional
+        Cache the parsed table on disk so reading the same .csv, .psv or
+        .xlsx file again with the same options is fast, by default True.
+        True uses a TableCache in home/.skm_python/table_cache,
+        False reads the file without the cache.
+        Tables read in chunks are not cached.
+    kwargs : keyword arguments
+        Passed to pandas method.
 
     Returns
     -------
-    pandas.DataFrame or TextParser
+    pandas.DataFrame or iterator of pandas.DataFrame
         The read data
 
     """
-    ext = os.path.splitext(filename)[1]
-    if ext == ".psv":
-        df = pd.read_csv(filename, delimiter="|")
-    elif ext == ".csv":
-        df = pd.read_csv(filename)
+    ext = _table_ext(filename)
+    if get_compression(filename) is not None:
+        memory_map = False
+    if chunksize is None and ext in TableCache.extensions:
+        cache = _resolve_cache(cache)
+    else:
+        cache = None
+    if cache is not None and os.path.getsize(filename) >= cache.min_bytes:
+        key = cache.key(
+            filename,
+            columns=columns,
+            filters=filters,
+            downcast=downcast,
+            engine=engine,
+            **kwargs,
+        )
+        df = cache.get(key)
+        if df is None:
+            df = _read_df(
+                filename, ext, columns, filters, downcast, memory_map, engine, kwargs
+            )
+            # e.g. sheet_name=None reads a dict of dataframes
+            if isinstance(df, pd.DataFrame):
+                cache.put(key, df)
+        return df
+
+    if chunksize is not None:
+        kwargs = _sample_dtypes_if_needed(filename, ext, columns, downcast, kwargs)
+        return _iter_df_chunks(
+            filename, ext, columns, filters, chunksize, downcast, memory_map, kwargs
+        )
+    return _read_df(
+        filename, ext, columns, filters, downcast, memory_map, engine, kwargs
+    )
+
+
+def _sample_dtypes_if_needed(filename, ext, columns, downcast, kwargs):
+    """Add categorical dtypes for text columns to kwargs when downcasting."""
+    if downcast and ext in (".csv", ".psv") and "dtype" not in kwargs:
+        sample_kwargs = dict(kwargs, usecols=columns)
+        if ext == ".psv":
+            sample_kwargs["delimiter"] = "|"
+        kwargs = dict(kwargs, dtype=_sample_csv_dtypes(filename, sample_kwargs))
+    return kwargs
+
+
+def _table_ext(filename):
+    """The table format of filename, checking compression is supported."""
+    ext = os.path.splitext(strip_compression(filename))[1]
+    if get_compression(filename) is not None and ext not in (".csv", ".psv"):
+        raise ValueError(
+            f"Compressed {ext} files are not supported, "
+            + "use the compression options of the format instead"
+        )
+    return ext
+
+
+def _read_df(filename, ext, columns, filters, downcast, memory_map, engine, kwargs):
+    """Read a whole file for df_from_file."""
+    kwargs = _sample_dtypes_if_needed(filename, ext, columns, downcast, kwargs)
+    if ext in (".csv", ".psv"):
+        if ext == ".psv":
+            kwargs["delimiter"] = "|"
+        if memory_map:
+            kwargs["memory_map"] = True
+        df = _read_csv(filename, engine, usecols=columns, **kwargs)
     elif ext == ".xlsx":
-        df = pd.read_excel(filename)
+        df = pd.read_excel(filename, usecols=columns, **kwargs)
+    elif ext == ".parquet":
+        df = pd.read_parquet(
+            filename,
+            columns=columns,
+            filters=filters,
+            memory_map=memory_map,
+            **kwargs,
+        )
+        return downcast_df(df) if downcast else df
+    elif ext in (".feather", ".arrow"):
+        source, expression = _read_feather(filename, columns, filters, memory_map)
+        if not memory_map:
+            source = source.to_table(columns=columns, filter=expression)
+        df = source.to_pandas(**kwargs)
+        return downcast_df(df) if downcast else df
+    elif ext in (".h5", ".hdf5"):
+        key = kwargs.pop("key", "df")
+        where = _filters_to_where(filters) if filters else None
+        df = pd.read_hdf(filename, key=key, columns=columns, where=where, **kwargs)
+        if where is not None:
+            return downcast_df(df) if downcast else df
     else:
         raise ValueError(f"Unsupported file extension {ext}")
-    return df
+    if filters:
+        df = df[_filters_to_mask(df, filters)]
+    return downcast_df(df) if downcast else df
+
+
+_write_pool = None
+
+
+def _get_write_pool():
+    """The thread pool for background df_to_file writes."""
+    global _write_pool
+    if _write_pool is None:
+        _write_pool = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="df_to_file"
+        )
+    return _write_pool
+
+
+def _ask_to_retry(filename):
+    """Ask the user whether to retry saving to filename."""
+    print(f"{filename} may currently be in use, try closing it")
+    while True:
+        done = input("When closed, please enter y to retry, or q to quit:\n")
+        if done.strip().lower() == "y":
+            print(f"Retrying saving to {filename}")
+            return True
+        elif done.strip().lower() == "q":
+            return False
+
+
+def _atomic_write(write, filename, retries, interactive, keep_existing=False):
+    """
+    Call write on a temporary file, then move it to filename.
 
+    The temporary file is in the same directory and is synced to disk
+    before it is renamed over filename, so filename is never left
+    partly written. Renaming is retried with exponential backoff if the
+    destination is in use.
+
+    Returns
+    -------
+    bool
+        True if filename was written, False if the user chose to quit.
 
-def df_to_file(df, filename, index=False, **kwargs):
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    temp_name = os.path.join(dirname, f".{stem}.{uuid.uuid4().hex[:8]}.tmp{ext}")
+    try:
+        if keep_existing and os.path.exists(filename):
+            shutil.copyfile(filename, temp_name)
+        write(temp_name)
+        fd = os.open(temp_name, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        delay = 0.1
+        attempt = 0
+        while True:
+            try:
+                os.replace(temp_name, filename)
+                break
+            except PermissionError:
+                if attempt < retries:
+                    time.sleep(delay)
+                    delay *= 2
+                    attempt += 1
+                elif interactive and _ask_to_retry(filename):
+                    attempt = 0
+                    delay = 0.1
+                elif interactive:
+                    os.remove(temp_name)
+                    return False
+                else:
+                    raise
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+    # Sync the directory too, so the rename itself survives a crash
+    if hasattr(os, "O_DIRECTORY"):
+        try:
+            fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+    return True
+
+
+def df_to_file(
+    df,
+    filename,
+    index=False,
+    retries=5,
+    interactive=None,
+    background=False,
+    level=None,
+    **kwargs,
+):
     """
     Save a pandas.DataFrame to filename.
 
+    Supported formats are .csv, .psv, .xlsx, .parquet, .feather or .arrow
+    (Arrow IPC), and .h5 or .hdf5. HDF5 files are written in table format
+    with every column queryable, so df_from_file can filter them.
+    .csv and .psv files are compressed if filename ends with a
+    compression suffix, such as .csv.gz or .csv.zst,
+    see compression.open_file.
+
+    The data is written to a temporary file which then replaces filename,
+    so if writing fails or the process is stopped, filename is either
+    the old file or the complete new file.
+    With mode="a", e.g. to append to a csv, the temporary file
+    starts as a copy of filename, so appending copies the whole file.
+
     Parameters
     ----------
     df : pandas.DataFrame
@@ -90,61 +787,187 @@ def df_to_file(df, filename, index=False, **kwargs):
         The path of the file to save to.
     index : bool
         Whether to write row names, by default False.
+    retries : int, optional
+        How many times to retry, with exponential backoff from 0.1 seconds,
+        if filename is in use (e.g. open in Excel on Windows), by default 5.
+    interactive : bool, optional
+        After the retries, ask the user to close the file and try again,
+        instead of raising a PermissionError.
+        By default, only if running in a terminal.
+    background : bool, optional
+        Write the file on a background thread and return straight away,
+        by default False. df should not be modified until the write is done.
+    level : int, optional
+        The compression level for compressed files,
+        by default the codec's default.
     kwargs : keyword arguments
         Passed to pandas method.
+        For example row_group_size for .parquet, or key for HDF5.
 
     Returns
     -------
-    None
-
-    """
-
-    def get_to_retry():
-        print(f"{filename} may currently be in use, try closing it")
-        retry = True
-        continue_ = True
-        while retry:
-            done = input("When closed, please enter y to retry, or q to quit:\n")
-            if len(done) == 0:
-                retry = True
-            elif done.strip().lower() == "y":
-                retry = False
-            elif done.strip().lower() == "q":
-                retry = False
-                continue_ = False
-        if continue_:
-            print(f"Retrying saving to {filename}")
-        return continue_
+    None or concurrent.futures.Future
+        If background, a future which is done when the file is written,
+        and which raises any error from writing in future.result().
+
+    Raises
+    ------
+    PermissionError
+        If filename is still in use after the retries, and not interactive.
+
+    """
+
+    def to_feather(path):
+        out_df = df.reset_index() if index else df.reset_index(drop=True)
+        out_df.to_feather(path, **kwargs)
+
+    def to_hdf(path):
+        out_df = df if index else df.reset_index(drop=True)
+        hdf_kwargs = {"key": "df", "format": "table", "data_columns": True}
+        hdf_kwargs.update(kwargs)
+        out_df.to_hdf(path, **hdf_kwargs)
+
+    def to_csv(path, sep):
+        if get_compression(path) is None:
+            df.to_csv(path, sep=sep, index=index, **kwargs)
+        else:
+            csv_kwargs = dict(kwargs)
+            mode = "a" if csv_kwargs.pop("mode", "w").startswith("a") else "w"
+            with open_file(path, mode, level=level, newline="") as f:
+                df.to_csv(f, sep=sep, index=index, **csv_kwargs)
+
+    writers = {
+        ".psv": lambda path: to_csv(path, "|"),
+        ".csv": lambda path: to_csv(path, ","),
+        ".xlsx": lambda path: df.to_excel(path, index=index, **kwargs),
+        ".parquet": lambda path: df.to_parquet(path, index=index, **kwargs),
+        ".feather": to_feather,
+        ".arrow": to_feather,
+        ".h5": to_hdf,
+        ".hdf5": to_hdf,
+    }
 
-    ext = os.path.splitext(filename)[1]
+    ext = _table_ext(filename)
+    if ext not in writers:
+        raise ValueError(f"Unsupported file extension {ext}")
     if os.path.dirname(filename) != "":
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-    if ext == ".psv":
-        try:
-            df.to_csv(filename, sep="|", index=index, **kwargs)
-        except PermissionError:
-            continue_ = get_to_retry()
-            if continue_:
-                df.to_csv(filename, sep="|", index=index, **kwargs)
-    elif ext == ".csv":
-        try:
-            df.to_csv(filename, sep=",", index=index, **kwargs)
-        except PermissionError:
-            continue_ = get_to_retry()
-            if continue_:
-                df.to_csv(filename, sep=",", index=index, **kwargs)
-    elif ext == ".xlsx":
-        try:
-            df.to_excel(filename, index=index, **kwargs)
-        except PermissionError:
-            continue_ = get_to_retry()
-            if continue_:
-                df.to_excel(filename, index=index, **kwargs)
-    else:
-        raise ValueError(f"Unsupported file extension {ext}")
+    append = str(kwargs.get("mode", "w")).startswith("a")
+    # HDF5 files can hold other keys, which are kept, and when appending
+    # the temporary file starts as a copy of filename
+    keep_existing = append or ext in (".h5", ".hdf5")
+    if background:
+        return _get_write_pool().submit(
+            _atomic_write, writers[ext], filename, retries, False, keep_existing
+        )
+    if interactive is None:
+        interactive = sys.stdin is not None and sys.stdin.isatty()
+    _atomic_write(writers[ext], filename, retries, interactive, keep_existing)
 
 
-def df_subset_from_rows(df, rows):
+class ChunkedTableWriter:
+    """
+    Write a table to a file in chunks, without holding it all in memory.
+
+    Every chunk must have the same columns and types as the first.
+    Supported formats are .csv, .psv, .parquet (one row group per chunk),
+    .feather or .arrow (one record batch per chunk), and .h5 or .hdf5.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the file to save to.
+    index : bool, optional
+        Whether to write row names, by default False.
+    min_itemsize : int or dict, optional
+        For .h5 and .hdf5 only, the minimum width of the string columns,
+        either for every column or as a dict from column name to width.
+        By default None, which uses the widest string in the first chunk,
+        so a later chunk with a longer string raises a ValueError.
+
+    Example
+    -------
+    with ChunkedTableWriter("out.parquet") as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    """
+
+    extensions = (".csv", ".psv", ".parquet", ".feather", ".arrow", ".h5", ".hdf5")
+
+    def __init__(self, filename, index=False, min_itemsize=None):
+        self.filename = filename
+        self.index = index
+        self.min_itemsize = min_itemsize
+        self.ext = os.path.splitext(filename)[1]
+        if self.ext not in self.extensions:
+            raise ValueError(f"Unsupported file extension {self.ext}")
+        if os.path.dirname(filename) != "":
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self._writer = None
+        self._schema = None
+        self.n_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, df):
+        """Append the rows of df to the file."""
+        if self.ext in (".csv", ".psv"):
+            df.to_csv(
+                self.filename,
+                sep="|" if self.ext == ".psv" else ",",
+                index=self.index,
+                mode="w" if self.n_rows == 0 else "a",
+                header=self.n_rows == 0,
+            )
+        elif self.ext in (".h5", ".hdf5"):
+            if self._writer is None:
+                self._writer = pd.HDFStore(self.filename, mode="w")
+            out_df = df if self.index else df.reset_index(drop=True)
+            min_itemsize = self.min_itemsize
+            if isinstance(min_itemsize, int):
+                min_itemsize = {
+                    name: min_itemsize
+                    for name in out_df.columns
+                    if pd.api.types.is_string_dtype(out_df[name])
+                }
+            self._writer.append(
+                "df",
+                out_df,
+                format="table",
+                data_columns=True,
+                index=False,
+                min_itemsize=min_itemsize,
+            )
+        else:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(
+                df, schema=self._schema, preserve_index=self.index
+            )
+            if self._writer is None:
+                self._schema = table.schema
+                if self.ext == ".parquet":
+                    import pyarrow.parquet as pq
+
+                    self._writer = pq.ParquetWriter(self.filename, self._schema)
+                else:
+                    self._writer = pa.ipc.new_file(self.filename, self._schema)
+            self._writer.write_table(table)
+        self.n_rows += len(df)
+
+    def close(self):
+        """Finish writing the file."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def df_subset_from_rows(df, rows, lazy=False):
     """
     Get a subset of a dataframe based on row indices.
 
@@ -154,13 +977,105 @@ def df_subset_from_rows(df, rows):
         The dataframe to subset from.
     rows : list-like of int
         The rows to grab.
+    lazy : bool, optional
+        Return a LazySubset, which only copies the columns that are used,
+        by default False.
 
     Returns
     -------
-    pandas.DataFrame
+    pandas.DataFrame or LazySubset
+        The rows, with the original row names in an "index" column.
+
+    """
+    if lazy:
+        return LazySubset(df, rows)
+    # iloc with a list of rows already returns new data, so no copy is needed
+    return df.iloc[rows].reset_index()
+
+
+def df_subsets_from_rows(df, row_sets, lazy=False):
+    """
+    Get many subsets of a dataframe at once, e.g. for bootstrapping.
 
+    All the rows are gathered with one take, and each subset is a
+    slice of the result, instead of allocating a frame per subset.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The dataframe to subset from.
+    row_sets : iterable of list-like of int
+        The rows to grab for each subset.
+    lazy : bool, optional
+        Return LazySubset objects, which only copy the columns that
+        are used, by default False.
+
+    Returns
+    -------
+    list of pandas.DataFrame or list of LazySubset
+        The subsets, as returned by df_subset_from_rows.
+
+    """
+    row_sets = [np.asarray(rows, dtype=np.intp) for rows in row_sets]
+    if lazy:
+        return [LazySubset(df, rows) for rows in row_sets]
+    if len(row_sets) == 0:
+        return []
+    gathered = df.iloc[np.concatenate(row_sets)].reset_index()
+    subsets = []
+    start = 0
+    for rows in row_sets:
+        subset = gathered.iloc[start : start + len(rows)]
+        subset.index = pd.RangeIndex(len(rows))
+        subsets.append(subset)
+        start += len(rows)
+    return subsets
+
+
+class LazySubset:
     """
-    return df.iloc[rows].copy().reset_index()
+    Rows of a dataframe, gathered only when they are used.
+
+    Indexing with a column name returns that column's values
+    for the rows as a numpy array, without copying any other column.
+    This suits resampling loops which only need a few columns
+    of each subset.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The dataframe to subset from. It should not be modified
+        while the subset is in use.
+    rows : list-like of int
+        The rows in the subset.
+
+    Example
+    -------
+    means = [
+        df_subset_from_rows(df, rows, lazy=True)["value"].mean()
+        for rows in resamples
+    ]
+
+    """
+
+    def __init__(self, df, rows):
+        self.df = df
+        self.rows = np.asarray(rows, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return f"LazySubset({len(self)} of {len(self.df)} rows)"
+
+    def __getitem__(self, column):
+        """Get the values of column for the rows in the subset."""
+        # Only the rows are converted, which matters for e.g. string columns
+        return self.df[column].take(self.rows).to_numpy()
+
+    def to_frame(self):
+        """Gather the subset into a dataframe, as in df_subset_from_rows."""
+        return df_subset_from_rows(self.df, self.rows)
 
 
 def show_interactive_table(table, notebook=False) -> None:
@@ -179,6 +1094,8 @@ def filter_table(
     """
     Filter a table based on a dictionary with possible values.
 
+    For many queries on the same large table, TableFilter is faster.
+
     Parameters
     ----------
     table: pd.DataFrame
@@ -198,9 +1115,260 @@ def filter_table(
     """
     if len(filter_dict) == 0:
         return table
-    filters = [table[k].isin(v) for k, v in filter_dict.items()]
-    if and_:
-        full_mask = np.logical_and.reduce(np.array(filters))
-    else:
-        full_mask = np.logical_or.reduce(np.array(filters))
+    full_mask = np.full(len(table), and_, dtype=bool)
+    for k, v in filter_dict.items():
+        col_mask = np.asarray(table[k].isin(v), dtype=bool)
+        if and_:
+            np.logical_and(full_mask, col_mask, out=full_mask)
+        else:
+            np.logical_or(full_mask, col_mask, out=full_mask)
     return table[full_mask]
+
+
+class _CodesIndex:
+    """A column stored as integer codes into its unique values."""
+
+    def __init__(self, col):
+        codes, uniques = pd.factorize(col, use_na_sentinel=True)
+        self.codes = codes
+        # The last entry stands for missing values, which have code -1
+        self.values = pd.Series(uniques).reindex(range(len(uniques) + 1))
+
+    def mask(self, predicates):
+        """The rows where all (op, value) predicates hold."""
+        # Evaluate the ops once per unique value, then look up each row
+        lookup = np.ones(len(self.values), dtype=bool)
+        for op, value in predicates:
+            lookup &= np.asarray(_FILTER_OPS[op](self.values, value), dtype=bool)
+        return lookup[self.codes]
+
+
+class _SortedIndex:
+    """A numeric column stored with the order that sorts it."""
+
+    range_ops = ("=", "==", "<", "<=", ">", ">=")
+
+    def __init__(self, col):
+        self.values = col.to_numpy()
+        self.n_rows = len(self.values)
+        self.order = np.argsort(self.values, kind="stable")
+        self.sorted = self.values[self.order]
+        # NaN sorts last and never compares as True
+        self.n_valid = self.n_rows - int(np.count_nonzero(np.isnan(self.sorted)))
+
+    def _range(self, predicates):
+        """The sorted positions where all range predicates hold."""
+        valid = self.sorted[: self.n_valid]
+        start, stop = 0, self.n_valid
+        for op, value in predicates:
+            if op in ("=", "=="):
+                start = max(start, np.searchsorted(valid, value, "left"))
+                stop = min(stop, np.searchsorted(valid, value, "right"))
+            elif op == "<":
+                stop = min(stop, np.searchsorted(valid, value, "left"))
+            elif op == "<=":
+                stop = min(stop, np.searchsorted(valid, value, "right"))
+            elif op == ">":
+                start = max(start, np.searchsorted(valid, value, "right"))
+            else:
+                start = max(start, np.searchsorted(valid, value, "left"))
+        return start, stop
+
+    def _set_range(self, start, stop, out):
+        """Set out to True for the rows at sorted positions start to stop."""
+        if stop <= start:
+            return
+        if stop - start < self.n_rows // 8:
+            out[self.order[start:stop]] = True
+        else:
+            # Ranges never split equal values, so for large ranges it is
+            # faster to compare with the end values than to scatter
+            low, high = self.sorted[start], self.sorted[stop - 1]
+            out |= (self.values >= low) & (self.values <= high)
+
+    def mask(self, predicates):
+        """The rows where all (op, value) predicates hold."""
+        ranges = [p for p in predicates if p[0] in self.range_ops]
+        if len(ranges) > 0:
+            mask = np.zeros(self.n_rows, dtype=bool)
+            self._set_range(*self._range(ranges), mask)
+        else:
+            mask = np.ones(self.n_rows, dtype=bool)
+        for op, value in predicates:
+            if op in self.range_ops:
+                continue
+            col_mask = np.zeros(self.n_rows, dtype=bool)
+            values = value if op in ("in", "not in") else [value]
+            for v in values:
+                if pd.isna(v):
+                    # NaN != NaN, see _FILTER_OPS
+                    if op != "!=":
+                        col_mask[self.order[self.n_valid :]] = True
+                else:
+                    self._set_range(*self._range([("==", v)]), col_mask)
+            # op is "!=", "not in" or "in"
+            if op == "in":
+                mask &= col_mask
+            else:
+                mask &= ~col_mask
+        return mask
+
+    def indices(self, predicates):
+        """The sorted row indices where all range predicates hold."""
+        start, stop = self._range(predicates)
+        return np.sort(self.order[start:stop])
+
+
+class TableFilter:
+    """
+    Answer repeated filter queries on a table using indexes of its columns.
+
+    The first query on a column builds an index of it, which is reused by
+    later queries, so each query does not rescan the column values.
+    Numeric columns are sorted once, so range predicates are a binary
+    search, and other columns are factorized into integer codes,
+    so predicates are evaluated once per unique value.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        The table to filter. It should not be modified while in use,
+        as the indexes would then be out of date.
+    columns : list of str, optional
+        Columns to index straight away, by default they are indexed
+        when first queried.
+
+    Example
+    -------
+    table_filter = TableFilter(df)
+    subset = table_filter.filter([("group", "in", ["a", "b"]), ("t", ">=", 0.5)])
+    rows = table_filter.indices({"group": ["a"]})
+
+    """
+
+    def __init__(self, table, columns=None):
+        self.table = table
+        self._indexes = {}
+        for column in [] if columns is None else columns:
+            self._index(column)
+
+    def __repr__(self):
+        return f"TableFilter(indexed={list(self._indexes)})"
+
+    def mask(self, filters, and_=True, invert=False):
+        """
+        Get a boolean mask of the rows that match filters.
+
+        Parameters
+        ----------
+        filters : dict or list of tuple
+            Either a dictionary of column to possible values, as in
+            filter_table, or a list of (column, op, value) tuples
+            as in df_from_file, where op is one of "==", "!=", "<", "<=",
+            ">", ">=", "in" or "not in".
+        and_ : bool, optional
+            Whether rows must match all filters or any filter,
+            by default all filters.
+        invert : bool, optional
+            Return the rows that do not match, by default False.
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            The mask, with one entry per row of the table.
+
+        """
+        filters = self._as_filters(filters)
+        for _, op, _ in filters:
+            if op not in _FILTER_OPS:
+                raise ValueError(f"Unsupported filter operation {op}")
+        mask = np.full(len(self.table), and_ or len(filters) == 0, dtype=bool)
+        if and_:
+            # All predicates on a column are combined by its index
+            by_column = {}
+            for column, op, value in filters:
+                by_column.setdefault(column, []).append((op, value))
+            groups = by_column.items()
+        else:
+            groups = [(column, [(op, value)]) for column, op, value in filters]
+        for column, predicates in groups:
+            col_mask = self._column_mask(column, predicates)
+            if and_:
+                np.logical_and(mask, col_mask, out=mask)
+            else:
+                np.logical_or(mask, col_mask, out=mask)
+        if invert:
+            np.logical_not(mask, out=mask)
+        return mask
+
+    def indices(self, filters, and_=True, invert=False):
+        """
+        Get the positions of the rows that match filters.
+
+        Takes the same arguments as mask.
+        Range predicates on a single numeric column are answered
+        from its sorted index without building a mask.
+
+        Returns
+        -------
+        numpy.ndarray of int
+            The sorted row positions, for use with table.iloc or take.
+
+        """
+        filters = self._as_filters(filters)
+        columns = {column for column, _, _ in filters}
+        if len(columns) == 1 and (and_ or len(filters) == 1) and not invert:
+            index = self._index(columns.pop())
+            predicates = [(op, value) for _, op, value in filters]
+            if isinstance(index, _SortedIndex) and all(
+                op in index.range_ops for op, _ in predicates
+            ):
+                try:
+                    return index.indices(predicates)
+                except (TypeError, ValueError, OverflowError):
+                    pass
+        return np.flatnonzero(self.mask(filters, and_=and_, invert=invert))
+
+    def filter(self, filters, and_=True, invert=False):
+        """
+        Get the rows of the table that match filters.
+
+        Takes the same arguments as mask.
+        If the matching rows are contiguous a slice of the table is
+        returned, which pandas can give without copying the data.
+
+        Returns
+        -------
+        pandas.DataFrame
+
+        """
+        rows = self.indices(filters, and_=and_, invert=invert)
+        if len(rows) == 0 or rows[-1] - rows[0] + 1 == len(rows):
+            start = rows[0] if len(rows) else 0
+            return self.table.iloc[start : start + len(rows)]
+        return self.table.take(rows)
+
+    def _column_mask(self, column, predicates):
+        try:
+            return self._index(column).mask(predicates)
+        except (TypeError, ValueError, OverflowError):
+            # e.g. a value that can't be compared with the index
+            col = self.table[column]
+            mask = np.ones(len(col), dtype=bool)
+            for op, value in predicates:
+                mask &= np.asarray(_FILTER_OPS[op](col, value), dtype=bool)
+            return mask
+
+    def _as_filters(self, filters):
+        if isinstance(filters, dict):
+            return [(k, "in", v) for k, v in filters.items()]
+        return list(filters)
+
+    def _index(self, column):
+        if column not in self._indexes:
+            col = self.table[column]
+            if col.dtype.kind in "iuf":
+                self._indexes[column] = _SortedIndex(col)
+            else:
+                self._indexes[column] = _CodesIndex(col)
+        return self._indexes[column]
@@ -0,0 +1,257 @@
+"""Concurrent file copying and moving."""
+import os
+import shutil
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import perf_counter
+
+# Linux ioctl request to clone a file's extents (reflink)
+_FICLONE = 0x40049409
+
+
+class CopyStats:
+    """Counts and throughput of a copy_files run."""
+
+    def __init__(self):
+        self.copied = 0
+        self.linked = 0
+        self.moved = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, other):
+        """Add the counts of another CopyStats to these counts."""
+        for attr in ("copied", "linked", "moved", "skipped", "failed", "bytes"):
+            setattr(self, attr, getattr(self, attr) + getattr(other, attr))
+
+    @property
+    def throughput(self):
+        """The bytes transferred per second."""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return (
+            f"{self.copied} copied, {self.linked} linked, {self.moved} moved, "
+            + f"{self.skipped} up to date, {self.failed} failed, "
+            + f"{self.bytes / 1e6:.1f} MB in {self.seconds:.2f}s "
+            + f"({self.throughput / 1e6:.1f} MB/s)"
+        )
+
+
+def is_up_to_date(src, dst):
+    """
+    Return True if dst exists with the same size and mtime as src.
+
+    Modification times are compared to the second, as in rsync,
+    since some file systems store them at a coarse resolution.
+
+    """
+    try:
+        src_st = os.stat(src)
+        dst_st = os.stat(dst)
+    except OSError:
+        return False
+    return src_st.st_size == dst_st.st_size and int(src_st.st_mtime) == int(
+        dst_st.st_mtime
+    )
+
+
+def _same_filesystem(src, dst):
+    try:
+        return os.stat(src).st_dev == os.stat(os.path.dirname(dst) or ".").st_dev
+    except OSError:
+        return False
+
+
+def _fast_copyfile(src, dst):
+    """
+    Copy the contents of src to dst, using kernel side copies if possible.
+
+    Tries a reflink (copy on write clone), then copy_file_range,
+    which lets some file systems (e.g. NFS 4.2) copy on the server,
+    before falling back to shutil.copyfile.
+
+    """
+    if not sys.platform.startswith("linux"):
+        shutil.copyfile(src, dst)
+        return
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        if hasattr(os, "copy_file_range"):
+            size = os.fstat(fsrc.fileno()).st_size
+            try:
+                offset = 0
+                while offset < size:
+                    sent = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), size - offset
+                    )
+                    if sent == 0:
+                        break
+                    offset += sent
+                if offset == size:
+                    return
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 1 << 20)
+
+
+def copy_file(src, dst, move=False, link=False, skip_up_to_date=True):
+    """
+    Copy or move a single file.
+
+    Parameters
+    ----------
+    src : str
+        The path to the file to copy.
+    dst : str
+        The path to copy to.
+    move : bool, optional
+        Move the file instead of copying it, by default False.
+    link : bool, optional
+        Hard link instead of copying when src and dst are on the
+        same file system, by default False.
+        Note that changes to a hard linked file are seen in both places.
+    skip_up_to_date : bool, optional
+        Skip files where dst has the same size and mtime as src,
+        by default True. Files are never skipped when moving,
+        so that src is always removed.
+
+    Returns
+    -------
+    str
+        What was done, one of "copied", "linked", "moved" or "skipped".
+
+    """
+    if move:
+        shutil.move(src, dst)
+        return "moved"
+    if skip_up_to_date and is_up_to_date(src, dst):
+        return "skipped"
+    if link and _same_filesystem(src, dst):
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.link(src, dst)
+            return "linked"
+        except OSError:
+            pass
+    if os.path.lexists(dst):
+        # dst may be a hard link, which must not be written through
+        os.remove(dst)
+    _fast_copyfile(src, dst)
+    # Keep the mtime, so that later runs can skip up to date files
+    shutil.copystat(src, dst)
+    return "copied"
+
+
+def copy_files(
+    pairs,
+    jobs=1,
+    move=False,
+    link=False,
+    skip_up_to_date=True,
+    verbose=True,
+    raise_on_error=True,
+):
+    """
+    Copy or move many files, optionally on a thread pool.
+
+    Pairs are consumed lazily with a bounded number of copies in flight,
+    so a generator such as path.iter_files_in_dir can be used directly.
+    Destination directories are created as needed.
+
+    Parameters
+    ----------
+    pairs : iterable of (str, str)
+        The (source, destination) paths.
+    jobs : int, optional
+        The number of files to copy at once, by default 1.
+    move : bool, optional
+        Move the files instead of copying them, by default False.
+    link : bool, optional
+        Hard link files on the same file system, by default False.
+    skip_up_to_date : bool, optional
+        Skip destinations with the same size and mtime as the source,
+        by default True.
+    verbose : bool, optional
+        Print a throughput summary, by default True.
+        Failures are always printed.
+    raise_on_error : bool, optional
+        Raise an OSError after every pair is done if any copy failed,
+        by default True. Otherwise failures are only counted.
+
+    Returns
+    -------
+    CopyStats
+        Counts of what was done and the throughput.
+
+    Raises
+    ------
+    OSError
+        If any copy failed and raise_on_error is True.
+
+    """
+    stats = CopyStats()
+    errors = []
+    made_dirs = set()
+    start_time = perf_counter()
+
+    def do_copy(src, dst):
+        result = copy_file(
+            src, dst, move=move, link=link, skip_up_to_date=skip_up_to_date
+        )
+        size = os.path.getsize(dst) if result in ("copied", "moved") else 0
+        return result, size
+
+    def record(src, get_result):
+        try:
+            result, size = get_result()
+        except OSError as e:
+            stats.failed += 1
+            errors.append(e)
+            print(f"Failed to copy {src}: {e}")
+            return
+        setattr(stats, result, getattr(stats, result) + 1)
+        stats.bytes += size
+
+    def make_parent(dst):
+        parent = os.path.dirname(dst)
+        if parent != "" and parent not in made_dirs:
+            os.makedirs(parent, exist_ok=True)
+            made_dirs.add(parent)
+
+    if jobs is None or jobs <= 1:
+        for src, dst in pairs:
+            make_parent(dst)
+            record(src, lambda: do_copy(src, dst))
+    else:
+        max_in_flight = jobs * 4
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            in_flight = {}
+            for src, dst in pairs:
+                make_parent(dst)
+                in_flight[pool.submit(do_copy, src, dst)] = src
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(in_flight.pop(future), future.result)
+            for future in list(in_flight):
+                record(in_flight.pop(future), future.result)
+
+    stats.seconds = perf_counter() - start_time
+    if verbose:
+        print(stats)
+    if raise_on_error and stats.failed > 0:
+        raise OSError(f"Failed to copy {stats.failed} files") from errors[0]
+    return stats